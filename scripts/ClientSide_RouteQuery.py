@@ -2,11 +2,33 @@ import xmlrpclib
 
 server = xmlrpclib.Server("http://localhost:8000")
 
+def TravelTimeMatrix(server, origins, destinations, date='', chunksize=50):
+    #streams the travel time matrix in chunks of origins, yields (origin, row of secs with -1 where there is no path)
+    for i in xrange(0, len(origins), chunksize):
+        chunk = origins[i:i+chunksize]
+        for origin, row in zip(chunk, server.GetTravelTimeMatrix(chunk, destinations, date)):
+            yield origin, row
+
 #Need to resolve I.O warnings ... and perhaps better format for o, d input.."
-rttime = server.GetRouteTime(o, d, validtrips, getstopid) 
+#the server uses its own validtrips/getstopid lookups, they are not sent with the request
+rttime = server.GetRouteTime(o, d)
 print rttime
 
 rtdetail = server.GetRouteDetail(o, d) 
 print rtdetail 
 
+#itinerary between two lat/lon points leaving after a time, no need to know the trip_id^stop_id events
+itinerary = server.GetRouteFromPoints([47.6097, -122.3331], [47.6588, -122.3130], '08:00:00')
+print itinerary['travel_time'], itinerary['arrival'], itinerary['path']
+
+#travel times between many origins and destinations, one search per origin on the server
+for origin, row in TravelTimeMatrix(server, origins, destinations):
+    print origin, row
+
+#hit/miss counters of the server's query cache (repeated GetRouteTime/GetRouteDetail queries)
+print server.GetCacheStats()
+
+#build phases, graph size and query latency percentiles of the server worker answering the call
+print server.Stats()
+
 server.Quit()
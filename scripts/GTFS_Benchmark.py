@@ -0,0 +1,242 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS benchmarks
+# Purpose:     Builds search graphs from GTFS feeds (test-data/amtrak.zip by default and synthetic feeds scaled by
+#              stops, routes and headway) and reports the time, peak memory and counts of every build phase plus the
+#              latency percentiles of route queries (dijkstra, cached) and of trip updates.
+#              Every feed runs in its own forked process so the peak memory is that of its build.
+#
+#              python GTFS_Benchmark.py                                      (amtrak.zip only)
+#              python GTFS_Benchmark.py --stops 400 1600 6400 --headway 600  (plus three synthetic feeds)
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+from math import sqrt, ceil
+import GTFS_RouteServer as RouteServer
+from GTFS_SearchGraph import NoPath
+from GTFS_QueryCache import QueryCache
+from GTFS_FeedReader import formatTime
+from GTFS_Stats import percentiles, peakMemory
+
+AMTRAK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test-data', 'amtrak.zip')
+
+
+def _writeTable(dir, name, header, rows):
+    fn = open(os.path.join(dir, name), 'wb')
+    writer = csv.writer(fn)
+    writer.writerow(header)
+    writer.writerows(rows)
+    fn.close()
+
+
+def writeSyntheticFeed(dir, stops=400, routes=20, stopsperroute=25, headway=900, first=6*3600, last=22*3600, seed=1):
+    '''dir = directory to write the feed to (created if needed)
+       stops = number of stops, laid out on a square grid about a quarter mile apart
+       routes = number of routes, each a random walk over neighbouring grid stops with stopsperroute stops (shorter if
+                the walk gets stuck), served in both directions
+       headway = secs between the trips of a route and direction from first to last (secs since midnight)
+       returns dict with the numbers of stops, routes, trips and stop times written
+    '''
+    rnd = random.Random(seed)
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    side = int(ceil(sqrt(stops)))
+    stoprows = [('S%d' % i, 'Stop %d' % i, '%.6f' % (45.5 + (i // side)*0.0036), '%.6f' % (-122.7 + (i % side)*0.0052))
+                for i in xrange(stops)]
+    routerows, triprows, timerows = [], [], []
+    for r in xrange(routes):
+        stop = rnd.randrange(stops)
+        walk = [stop]
+        heading = rnd.choice([(0, 1), (0, -1), (1, 0), (-1, 0)])
+        while len(walk) < stopsperroute:
+            moves = [heading] + rnd.sample([(0, 1), (0, -1), (1, 0), (-1, 0)], 4)   #--> keeps going straight if it can
+            for dr, dc in moves:
+                row, col = stop // side + dr, stop % side + dc
+                nxt = row*side + col
+                if 0 <= row < side and 0 <= col < side and nxt < stops and nxt not in walk:
+                    break
+            else:
+                break
+            stop, heading = nxt, (dr, dc)
+            walk.append(stop)
+        hops = [rnd.randint(60, 150) for k in xrange(len(walk)-1)]
+        route_id = 'R%d' % r
+        routerows.append((route_id, 'A', route_id, 3))
+        for direction in (0, 1):
+            seq = walk if direction == 0 else walk[::-1]
+            runs = hops if direction == 0 else hops[::-1]
+            for start in xrange(first + rnd.randrange(headway), last, headway):
+                trip_id = '%s_%d_%d' % (route_id, direction, start)
+                triprows.append((route_id, 'WK', trip_id, direction))
+                tm = start
+                for k, stop in enumerate(seq):
+                    if k > 0:
+                        tm += runs[k-1]
+                    timerows.append((trip_id, formatTime(tm), formatTime(tm), 'S%d' % stop, k+1))
+    _writeTable(dir, 'agency.txt', ['agency_id', 'agency_name', 'agency_url', 'agency_timezone'],
+                [('A', 'Synthetic', 'http://example.com', 'America/Los_Angeles')])
+    _writeTable(dir, 'stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'], stoprows)
+    _writeTable(dir, 'routes.txt', ['route_id', 'agency_id', 'route_short_name', 'route_type'], routerows)
+    _writeTable(dir, 'trips.txt', ['route_id', 'service_id', 'trip_id', 'direction_id'], triprows)
+    _writeTable(dir, 'stop_times.txt', ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'], timerows)
+    _writeTable(dir, 'calendar.txt', ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+                                      'sunday', 'start_date', 'end_date'], [('WK', 1, 1, 1, 1, 1, 1, 1, '20200101', '20301231')])
+    return {'stops': stops, 'routes': routes, 'trips': len(triprows), 'stop_times': len(timerows)}
+
+
+def queryPairs(G, count, rnd, cutoff=4*3600):
+    #count (origin, destination) event pairs with a path, the destination is a random event settled by a search
+    #from the origin at another stop, returns the pairs and the same origins with another such destination
+    events = [u for u in xrange(G.numberOfNodes()) if G.nodetrip[u] >= 0 and G.nodedep[u] >= 0]
+    pairs, samepairs = [], []
+    for attempt in xrange(count*10):
+        if len(pairs) >= count or not events:
+            break
+        o = rnd.choice(events)
+        reached = [v for v in G.dijkstra(o, cutoff=cutoff)[0] if G.nodetrip[v] >= 0 and G.nodestop[v] <> G.nodestop[o]]
+        if reached:
+            pairs.append((o, rnd.choice(reached)))
+            samepairs.append((o, rnd.choice(reached)))
+    return pairs, samepairs
+
+
+def timeQueries(func, pairs):
+    #latency percentiles in ms of func(o, d) over the pairs
+    samples = []
+    for o, d in pairs:
+        ts = time.time()
+        try:
+            func(o, d)
+        except NoPath:
+            pass
+        samples.append((time.time() - ts)*1000.0)
+    result = percentiles(samples)
+    result['queries'] = len(samples)
+    return result
+
+
+def benchmarkFeed(name, dir, options):
+    '''builds the graph of one feed and times queries on it, options = parsed command line
+       returns dict of the feed, its build phases and the query latencies
+    '''
+    rnd = random.Random(options.seed)
+    #--> graph of the trips running on one weekday (calendar.txt), queries need no service mask
+    G, validservices, validtrips, stoptrips, getstopid, stopdata = RouteServer.BuildSearchGraph(
+        dir, options.xferpen, 1, day=options.day, prune=options.prune, processes=options.processes)
+    result = {'feed': name, 'nodes': G.numberOfNodes(), 'edges': G.numberOfEdges(), 'build': G.buildstats,
+              'build_secs': sum(phase['secs'] for phase in G.buildstats)}
+    result['peak_mb'] = peakMemory()[0]
+    pairs, samepairs = queryPairs(G, options.queries, rnd)
+    queries = {}
+    queries['dijkstra'] = timeQueries(lambda o, d: G.shortestPath(o, d), pairs)
+    cache = QueryCache()
+    timeQueries(lambda o, d: cache.shortestPath(G, o, d), pairs)
+    queries['cached'] = timeQueries(lambda o, d: cache.shortestPath(G, o, d), pairs)
+    #--> origins again with other destinations, answered from their search trees where settled
+    queries['cached_origin'] = timeQueries(lambda o, d: cache.shortestPath(G, o, d), samepairs)
+    queries['cache'] = cache.stats()
+    #trip updates: a delay on one trip at a time, patched in place and taken back
+    trips = rnd.sample(sorted(validtrips), min(options.updates, len(validtrips)))
+    samples = []
+    tripevents = G.patchIndex()[0]
+    for trip_id in trips:
+        events = tripevents.get(G.trips.get(trip_id))
+        if not events:
+            continue
+        stop_id = G.stops.names[G.nodestop[events[0]]]
+        for updates in ({trip_id: [(stop_id, 300, 300)]}, {}):
+            ts = time.time()
+            RouteServer.patchTripUpdates(G, updates, validtrips, options.xferpen)
+            samples.append((time.time() - ts)*1000.0)
+    queries['trip_update'] = percentiles(samples)
+    queries['trip_update']['queries'] = len(samples)
+    result['queries'] = queries
+    return result
+
+
+def _runFeed(args):
+    return benchmarkFeed(*args)
+
+
+def runIsolated(args):
+    #runs benchmarkFeed in a forked process (peak memory of that build only) where fork is available
+    if not hasattr(os, 'fork'):
+        return benchmarkFeed(*args)
+    import multiprocessing
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_runFeed, (args,))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def printResult(result):
+    print
+    print '=== ', result['feed'], ': ', result['nodes'], ' nodes ', result['edges'], ' edges, built in %.2f secs, peak %s MB' % (
+        result['build_secs'], '%.0f' % result['peak_mb'] if result['peak_mb'] is not None else '?')
+    for phase in result['build']:
+        counts = ', '.join('%s=%s' % (key, value) for key, value in sorted(phase.iteritems()) if key not in ('phase', 'secs', 'peak_mb'))
+        print '  %-20s %8.3f secs  %8s MB  %s' % (phase['phase'], phase['secs'],
+                                                 '%.0f' % phase['peak_mb'] if phase['peak_mb'] is not None else '?', counts)
+    for method in ('dijkstra', 'cached', 'cached_origin', 'trip_update'):
+        row = result['queries'][method]
+        if row.get('queries'):
+            print '  %-20s %5d x  p50 %8.2f ms  p90 %8.2f ms  p99 %8.2f ms  max %8.2f ms' % (
+                method, row['queries'], row['p50'], row['p90'], row['p99'], row['max'])
+    cache = result['queries']['cache']
+    print '  cache: ', cache['hits'], ' hits ', cache['treehits'], ' tree hits ', cache['misses'], ' misses'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks graph builds and route queries on GTFS feeds')
+    parser.add_argument('--feed', nargs='*', default=[AMTRAK], help='feed directories or zip archives (default amtrak.zip)')
+    parser.add_argument('--stops', nargs='*', type=int, default=[], help='synthetic feeds with these numbers of stops')
+    parser.add_argument('--routes', type=int, default=0, help='routes of the synthetic feeds (0--> stops/20)')
+    parser.add_argument('--stopsperroute', type=int, default=25)
+    parser.add_argument('--headway', type=int, default=900, help='secs between trips of the synthetic routes')
+    parser.add_argument('--transferdist', type=float, default=0.25, help='miles between stops for synthetic transfers')
+    parser.add_argument('--day', default='friday', help='weekday of the trips in the graph (calendar.txt)')
+    parser.add_argument('--xferpen', type=int, default=650)
+    parser.add_argument('--prune', action='store_true', help='dominance pruned transfer edges')
+    parser.add_argument('--processes', type=int, default=1, help='build worker processes')
+    parser.add_argument('--queries', type=int, default=100, help='route queries per search method')
+    parser.add_argument('--updates', type=int, default=5, help='trips delayed (and restored) one at a time')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the results to this file as well')
+    options = parser.parse_args()
+
+    feeds = [(os.path.basename(path), path) for path in options.feed]
+    tmp = tempfile.mkdtemp(prefix='gtfs_bench_')
+    results = []
+    try:
+        for stops in options.stops:
+            dir = os.path.join(tmp, 'synthetic_%d' % stops)
+            counts = writeSyntheticFeed(dir, stops, options.routes or max(1, stops // 20), options.stopsperroute,
+                                        options.headway, seed=options.seed)
+            RouteServer.createTransferFile(dir, options.transferdist)
+            feeds.append(('synthetic %(stops)d stops %(routes)d routes %(trips)d trips %(stop_times)d stop times' % counts, dir))
+        for name, path in feeds:
+            result = runIsolated((name, path, options))
+            printResult(result)
+            results.append(result)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if options.json:
+        fn = open(options.json, 'w')
+        json.dump(results, fn, indent=1)
+        fn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS profile check
+# Purpose:     Cross-checks the profile queries of the connection scan engine against forward earliest arrival
+#              queries on random stop pairs and departure windows:
+#              1) every profile entry (dep, arr) is what a forward query leaving at dep gets, unless that forward
+#                 journey leaves the source after the window
+#              2) a forward query from any time t in the window that leaves the source within the window arrives no
+#                 earlier than the profile entries leaving at or after t, and one of them arrives as early
+#
+#              python GTFS_CheckProfile.py                                (amtrak.zip)
+#              python GTFS_CheckProfile.py --stops 400 --queries 300      (synthetic feed with footpaths)
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import argparse
+import GTFS_RouteServer as RouteServer
+from GTFS_ConnectionScan import ConnectionScan
+from GTFS_FeedReader import formatTime
+from GTFS_Benchmark import AMTRAK, writeSyntheticFeed
+
+
+def latestDeparture(legs):
+    #latest time the journey of a forward query can leave the source (a first walk is taken just in time), None
+    #for walks without a trip
+    if not legs or (legs[0][0] is None and len(legs) < 2):
+        return None
+    if legs[0][0] is None:
+        return legs[1][2] - (legs[0][4] - legs[0][2])
+    return legs[0][2]
+
+
+def checkQuery(csa, src, tgt, t0, t1, samples, rnd):
+    #returns list of disagreements between the profile of src->tgt in [t0, t1] and forward queries
+    profile = csa.profile(src, tgt, t0, t1)
+    errors = []
+    for dep, arr in profile:
+        ea, legs = csa.earliestArrival(src, tgt, dep)
+        if ea is None or ea > arr:
+            errors.append('entry %s->%s cannot be reached, forward %s' % (formatTime(dep), formatTime(arr), ea and formatTime(ea)))
+        elif ea < arr and latestDeparture(legs) is not None and latestDeparture(legs) <= t1:
+            errors.append('entry %s->%s beaten by forward %s->%s' % (formatTime(dep), formatTime(arr),
+                                                                   formatTime(latestDeparture(legs)), formatTime(ea)))
+    for t in [rnd.randint(t0, t1) for k in xrange(samples)] + [dep for dep, arr in profile]:
+        later = [arr for dep, arr in profile if dep >= t]
+        ea, legs = csa.earliestArrival(src, tgt, t)
+        leave = latestDeparture(legs)
+        if ea is None or leave is None or leave > t1:
+            continue
+        if not later or min(later) > ea:
+            errors.append('forward %s->%s missing, profile from %s gives %s' % (formatTime(leave), formatTime(ea), formatTime(t),
+                                                                               later and formatTime(min(later))))
+        elif min(later) < ea:
+            errors.append('profile from %s gives %s before forward %s' % (formatTime(t), formatTime(min(later)), formatTime(ea)))
+    return profile, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-checks connection scan profiles against forward queries')
+    parser.add_argument('--feed', default=AMTRAK, help='feed directory or zip archive (default amtrak.zip)')
+    parser.add_argument('--stops', type=int, default=0, help='use a synthetic feed with this many stops instead')
+    parser.add_argument('--transferdist', type=float, default=0.25, help='miles between stops for synthetic transfers')
+    parser.add_argument('--day', default='friday', help='weekday of the trips (calendar.txt)')
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--window', type=int, default=3600, help='departure window secs')
+    parser.add_argument('--samples', type=int, default=5, help='forward queries per profile at random times')
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    tmp = None
+    feed = options.feed
+    if options.stops:
+        tmp = tempfile.mkdtemp(prefix='gtfs_check_')
+        feed = os.path.join(tmp, 'synthetic')
+        writeSyntheticFeed(feed, options.stops, max(1, options.stops // 20), seed=options.seed)
+        RouteServer.createTransferFile(feed, options.transferdist)
+    try:
+        csa = ConnectionScan()
+        RouteServer.BuildSearchGraph(feed, 0, 1, day=options.day, engines=[csa])
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    stops = sorted(csa.stops.names)
+    entries = bad = 0
+    for k in xrange(options.queries):
+        src, tgt = rnd.sample(stops, 2)
+        t0 = rnd.randint(6*3600, 20*3600)
+        profile, errors = checkQuery(csa, src, tgt, t0, t0 + options.window, options.samples, rnd)
+        entries += len(profile)
+        bad += len(errors)
+        for error in errors[:3]:
+            print '%s->%s window %s-%s: %s' % (src, tgt, formatTime(t0), formatTime(t0 + options.window), error)
+    print options.queries, ' profiles, ', entries, ' entries, ', bad, ' disagreements with forward queries'
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == '__main__':
+    main()
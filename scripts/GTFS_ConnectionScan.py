@@ -0,0 +1,210 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS connection scan (alternative query engine for the route server)
+# Purpose:     Answers earliest arrival queries with the Connection Scan Algorithm: all elementary connections (one
+#              trip from one stop to the next) are kept in arrays sorted by departure time and a query is a single
+#              linear scan from the departure time on. Profile queries (all Pareto optimal departure/arrival pairs of
+#              a departure window) are one backward scan. Transfers at a stop need mintransfer secs, transfers
+#              between stops use the transfers.txt walk times (one walk after each trip, as in the search graph).
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+from array import array
+from math import ceil
+from bisect import bisect_left, bisect_right
+from GTFS_SearchGraph import IDTable
+
+INF = 1 << 30
+
+
+class ConnectionScan(object):
+    '''connections from the stop_times.txt rows of the valid trips, collected with addStopTime()/addFootpath() and
+       sorted by finalize()
+       mintransfer = secs needed to change trips at a stop (1--> the next trip must leave after the arrival)
+    '''
+    def __init__(self, mintransfer=1):
+        self.mintransfer = mintransfer
+        self.trips = IDTable()
+        self.stops = IDTable()
+        self.depstop = array('i')
+        self.arrstop = array('i')
+        self.deptime = array('i')
+        self.arrtime = array('i')
+        self.trip = array('i')
+        self.service = array('i')   #connection -> service index (graphs covering the whole feed period only)
+        self.footpaths = {}         #stop index -> list of (stop index, walk secs)
+        self._prev = (None, None, None)
+
+    def __str__(self):
+        return 'connection scan, %d connections' % len(self.trip)
+
+    def addStopTime(self, trip_id, stop_id, arrtm, deptm):
+        #stop_times.txt rows in file order (secs None if missing), consecutive rows of a trip make a connection
+        prevtrip, prevstop, prevdep = self._prev
+        if trip_id == prevtrip and prevdep is not None and arrtm is not None:
+            self.addConnection(trip_id, prevstop, stop_id, prevdep, arrtm)
+        self._prev = (trip_id, stop_id, deptm)
+
+    def addConnection(self, trip_id, dep_stop, arr_stop, deptm, arrtm):
+        self.trip.append(self.trips.intern(trip_id))
+        self.depstop.append(self.stops.intern(dep_stop))
+        self.arrstop.append(self.stops.intern(arr_stop))
+        self.deptime.append(deptm)
+        self.arrtime.append(arrtm)
+
+    def addFootpath(self, from_stop, to_stop, walk):
+        #walk = walk secs from from_stop to to_stop (e.g. transfers.txt min_transfer_time)
+        paths = self.footpaths.setdefault(self.stops.intern(from_stop), [])
+        paths.append((self.stops.intern(to_stop), int(ceil(walk))))
+
+    def setServices(self, tripservices, services):
+        #tripservices = dict trip_id -> service_id, services = IDTable of the service_ids (SearchGraph.services) so
+        #the same serviceMask() works for both engines
+        tripservice = array('i', [services.get(tripservices[self.trips.names[t]], -1) for t in xrange(len(self.trips))])
+        self.service = array('i', [tripservice[t] for t in self.trip])
+
+    def finalize(self):
+        #sorts the connections by departure (then arrival, zero time connections of a trip keep their trip order)
+        self._prev = (None, None, None)
+        order = sorted(xrange(len(self.trip)), key=lambda i: (self.deptime[i], self.arrtime[i]))
+        for name in ['depstop', 'arrstop', 'deptime', 'arrtime', 'trip', 'service']:
+            values = getattr(self, name)
+            if len(values):
+                setattr(self, name, array('i', [values[i] for i in order]))
+        return self
+
+    def numberOfConnections(self):
+        return len(self.trip)
+
+    def earliestArrival(self, source, target, t, active=None):
+        '''source, target = stop_ids
+           t = earliest departure from source in secs
+           active = serviceMask() of the query date (None--> all connections)
+           returns (arrival secs, legs) or (None, []) if target cannot be reached, legs = list of
+           (trip_id, from stop_id, departure secs, to stop_id, arrival secs) with trip_id None for walks
+        '''
+        src, tgt = self.stops.get(source), self.stops.get(target)
+        if src is None or tgt is None:
+            return None, []
+        depstop, arrstop, deptime, arrtime, trip = self.depstop, self.arrstop, self.deptime, self.arrtime, self.trip
+        service = self.service if active is not None and len(self.service) else None
+        footpaths, mintransfer = self.footpaths, self.mintransfer
+        n = len(self.stops)
+        arrival = [INF]*n
+        ready = [INF]*n             #--> earliest time a trip can be boarded at the stop
+        arrlabel = {}               #stop -> (entry connection, exit connection, stop walked from or -1)
+        readylabel = {}
+        arrival[src] = ready[src] = t
+        for b, w in footpaths.get(src, ()):
+            if t + w < ready[b]:
+                arrival[b] = ready[b] = t + w
+                arrlabel[b] = readylabel[b] = (-1, -1, src)
+        best = arrival[tgt]
+        boarded = {}                #trip -> connection it was boarded with
+        for i in xrange(bisect_left(deptime, t), len(trip)):
+            dep = deptime[i]
+            if dep >= best:
+                break               #--> no later connection can arrive earlier
+            tr = trip[i]
+            enter = boarded.get(tr)
+            if enter is None:
+                if ready[depstop[i]] > dep or (service is not None and not active[service[i]]):
+                    continue
+                enter = boarded[tr] = i
+            a, at = arrstop[i], arrtime[i]
+            if at < arrival[a]:
+                arrival[a] = at
+                arrlabel[a] = (enter, i, -1)
+            if at + mintransfer < ready[a]:
+                ready[a] = at + mintransfer
+                readylabel[a] = (enter, i, -1)
+            for b, w in footpaths.get(a, ()):
+                if at + w < ready[b]:
+                    ready[b] = at + w
+                    readylabel[b] = (enter, i, a)
+                if at + w < arrival[b]:
+                    arrival[b] = at + w
+                    arrlabel[b] = (enter, i, a)
+            best = arrival[tgt]
+        if best >= INF:
+            return None, []
+        return best, self._legs(arrlabel.get(tgt), readylabel, tgt, best, ready)
+
+    def _legs(self, label, readylabel, stop, time, ready):
+        #walks the labels back from the target stop (reached at time) to the source
+        names, tripnames = self.stops.names, self.trips.names
+        legs = []
+        while label is not None:
+            enter, exit, walkfrom = label
+            if walkfrom >= 0:
+                #--> a walk ends at the label time of its stop and starts at the arrival of the trip (or the departure)
+                legs.append((None, names[walkfrom], ready[walkfrom] if exit < 0 else self.arrtime[exit], names[stop], time))
+            if exit < 0:
+                break
+            legs.append((tripnames[self.trip[enter]], names[self.depstop[enter]], self.deptime[enter], names[self.arrstop[exit]], self.arrtime[exit]))
+            stop = self.depstop[enter]
+            time = ready[stop]
+            label = readylabel.get(stop)
+        legs.reverse()
+        return legs
+
+    def profile(self, source, target, t0, t1, active=None):
+        '''source, target = stop_ids
+           t0, t1 = departure window in secs
+           active = serviceMask() of the query date (None--> all connections)
+           returns the Pareto optimal (departure secs, arrival secs) pairs leaving source within the window, in
+           departure order (a later departure always arrives later)
+        '''
+        src, tgt = self.stops.get(source), self.stops.get(target)
+        if src is None or tgt is None or src == tgt:
+            return []
+        depstop, arrstop, deptime, arrtime, trip = self.depstop, self.arrstop, self.deptime, self.arrtime, self.trip
+        service = self.service if active is not None and len(self.service) else None
+        footpaths, mintransfer = self.footpaths, self.mintransfer
+        walkto = dict((a, w) for a, paths in footpaths.iteritems() for b, w in paths if b == tgt)
+        negdeps = {}                #stop -> -departures of its profile entries (ascending, entries are added backwards)
+        arrs = {}                   #stop -> arrivals at target of the entries
+        tripbest = {}               #trip -> earliest arrival at target staying on the trip
+        srcwalk = dict((b, w) for b, w in footpaths.get(src, ()))
+        srcwalk[src] = 0            #stops the source departures leave from -> walk from source
+        srcpairs = []               #(departure from source, arrival) of every departure in the window, kept apart from
+                                    #the stop profiles where a departure after t1 may dominate one inside the window
+        def evaluate(stop, t):
+            #earliest arrival at target boarding at stop at or after t
+            nd = negdeps.get(stop)
+            if nd is None:
+                return INF
+            k = bisect_right(nd, -t) - 1
+            return arrs[stop][k] if k >= 0 else INF
+        for i in xrange(len(trip)-1, bisect_left(deptime, t0)-1, -1):
+            if service is not None and not active[service[i]]:
+                continue
+            a, at, tr = arrstop[i], arrtime[i], trip[i]
+            tc = at if a == tgt else at + walkto.get(a, INF)
+            tc = min(tc, tripbest.get(tr, INF), evaluate(a, at + mintransfer))
+            for b, w in footpaths.get(a, ()):
+                tc = min(tc, at + w if b == tgt else evaluate(b, at + w))
+            if tc >= INF:
+                continue
+            if tc < tripbest.get(tr, INF):
+                tripbest[tr] = tc
+            s, dep = depstop[i], deptime[i]
+            if s in srcwalk and t0 <= dep - srcwalk[s] <= t1:
+                srcpairs.append((dep - srcwalk[s], tc))
+            nd = negdeps.setdefault(s, [])
+            sa = arrs.setdefault(s, [])
+            if sa and tc >= sa[-1]:
+                continue            #--> a later departure from s arrives as early
+            if nd and nd[-1] == -dep:
+                nd.pop()
+                sa.pop()
+            nd.append(-dep)
+            sa.append(tc)
+        result = []
+        for dep, arr in sorted(srcpairs, key=lambda x: (-x[0], x[1])):
+            if not result or arr < result[-1][1]:
+                result.append((dep, arr))
+        result.reverse()
+        return result
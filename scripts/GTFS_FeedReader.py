@@ -0,0 +1,170 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS feed reader
+# Purpose:     Reads GTFS tables row by row from an extracted directory or straight from the zip archive, so the
+#              graph build never has to hold a whole table (stop_times.txt in particular) in memory.
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import csv
+import os
+import zipfile
+import datetime
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def parseTime(hms):
+    #'HH:MM:SS' (hours may go past 24) -> seconds since midnight, raises ValueError if the string is not a time
+    h, m, s = hms.split(':')
+    return int(h)*3600 + int(m)*60 + int(s)
+
+
+def formatTime(secs):
+    #seconds since midnight -> 'HH:MM:SS' (hours go past 24 for the next day as in GTFS)
+    return '%02d:%02d:%02d' % (secs//3600, secs//60 % 60, secs % 60)
+
+
+class GTFSFeed(object):
+    '''a GTFS file set, path = directory with the .txt files or a .zip archive of them (files may sit in a sub folder)'''
+    def __init__(self, path):
+        self.path = path
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            self.members = {}
+            for member in self.zip.namelist():
+                name = member.replace('\\', '/').split('/')[-1]
+                if name and not self.members.has_key(name):
+                    self.members[name] = member
+        else:
+            self.zip = None
+            self.members = dict((name, os.path.join(path, name)) for name in os.listdir(path))
+
+    def files(self):
+        return set(self.members.keys())
+
+    def has(self, name):
+        return self.members.has_key(name)
+
+    def open(self, name):
+        #file object for a table, decompressed on the fly if the feed is a zip archive
+        if self.zip is not None:
+            return self.zip.open(self.members[name], 'rU')
+        return open(self.members[name], 'rb')
+
+    def table(self, name):
+        '''name = file name of the table e.g. 'stops.txt'
+           returns attix (dict column name -> index) and a generator of the csv rows, the file is closed when the
+           generator is exhausted
+        '''
+        fn = self.open(name)
+        reader = csv.reader(fn, delimiter=',')
+        try:
+            atts = reader.next()
+        except StopIteration:
+            atts = []
+        if atts and atts[0].startswith('\xef\xbb\xbf'):
+            atts[0] = atts[0][3:]   #--> utf-8 byte order mark
+        atts = [att.strip() for att in atts]
+        def rows():
+            try:
+                for row in reader:
+                    if row:
+                        yield row
+            finally:
+                fn.close()
+        return dict(zip(atts, range(len(atts)))), rows()
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+
+
+def stopTimes(feed, validtrips):
+    '''feed = GTFSFeed
+       validtrips = dict of trips to keep (trip_id -> route id)
+       yields trip_id, stop_id, arrival_time, departure_time, arrival secs, departure secs for the stop_times.txt rows
+       of valid trips in file order, each time string is parsed once (secs are None if the string does not parse)
+    '''
+    attix, rows = feed.table('stop_times.txt')
+    tripix, stopix, arrix, depix = attix['trip_id'], attix['stop_id'], attix['arrival_time'], attix['departure_time']
+    for row in rows:
+        trip_id = row[tripix]
+        if validtrips.has_key(trip_id):
+            arr, dep = row[arrix], row[depix]
+            try:
+                arrtm = parseTime(arr)
+            except ValueError:
+                arrtm = None
+            try:
+                deptm = parseTime(dep)
+            except ValueError:
+                deptm = None
+            yield trip_id, row[stopix], arr, dep, arrtm, deptm
+
+
+def tripUpdates(path):
+    '''path = trip updates file, a csv version of GTFS-realtime TripUpdates with the columns
+              trip_id,stop_id,arrival_delay,departure_delay,schedule_relationship
+              a row with schedule_relationship CANCELED cancels the whole trip (stop_id and delays empty), other rows
+              give the delay (secs, may be negative) at a stop, an empty delay is taken from the other one or from the
+              stops before as in GTFS-realtime
+       returns dict trip_id -> None for cancelled trips or list of (stop_id, arrival delay, departure delay) in file
+       order (delays None if empty)
+    '''
+    def delay(value):
+        return int(value) if value.strip() else None
+    updates = {}
+    fn = open(path, 'rb')
+    reader = csv.reader(fn, delimiter=',')
+    attix = dict((att.strip(), i) for i, att in enumerate(reader.next()))
+    relix = attix.get('schedule_relationship')
+    for row in reader:
+        if not row:
+            continue
+        trip_id = row[attix['trip_id']]
+        if relix is not None and row[relix].strip().upper() in ('CANCELED', 'CANCELLED'):
+            updates[trip_id] = None
+        elif updates.get(trip_id, ()) is not None:
+            updates.setdefault(trip_id, []).append((row[attix['stop_id']], delay(row[attix['arrival_delay']]),
+                                                    delay(row[attix['departure_delay']])))
+    fn.close()
+    return updates
+
+
+class ServiceCalendar(object):
+    '''services running on a date from calendar.txt (weekdays within start_date/end_date) and calendar_dates.txt
+       (1 -> service added, 2 -> service removed on that date)
+    '''
+    def __init__(self, feed):
+        self.weekly = {}        #service_id -> (set of weekday names, start_date, end_date)
+        self.exceptions = {}    #date -> dict service_id -> exception_type
+        if feed.has('calendar.txt'):
+            attix, reader = feed.table('calendar.txt')
+            for row in reader:
+                days = set(day for day in WEEKDAYS if row[attix[day]] == '1')
+                self.weekly[row[attix['service_id']]] = (days, row[attix['start_date']], row[attix['end_date']])
+        if feed.has('calendar_dates.txt'):
+            attix, reader = feed.table('calendar_dates.txt')
+            for row in reader:
+                self.exceptions.setdefault(row[attix['date']], {})[row[attix['service_id']]] = row[attix['exception_type']]
+
+    def window(self):
+        #first and last date (YYYYMMDD) covered by the calendar
+        dates = [start for days, start, end in self.weekly.itervalues()] + [end for days, start, end in self.weekly.itervalues()]
+        dates.extend(self.exceptions.keys())
+        return (min(dates), max(dates)) if dates else (None, None)
+
+    def services(self, date):
+        #date = YYYYMMDD, returns the set of service_ids running that day
+        day = WEEKDAYS[datetime.date(int(date[:4]), int(date[4:6]), int(date[6:8])).weekday()]
+        running = set(service_id for service_id, (days, start, end) in self.weekly.iteritems()
+                      if day in days and start <= date <= end)
+        for service_id, exception in self.exceptions.get(date, {}).iteritems():
+            if exception == '1':
+                running.add(service_id)
+            elif exception == '2':
+                running.discard(service_id)
+        return running
@@ -0,0 +1,138 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS query cache (repeated route queries for the route server)
+# Purpose:     Bounded LRU cache of shortest path results keyed on (origin, destination, query date) and of the
+#              settled search trees of origins, so a later destination from the same origin that was already settled
+#              is answered from memory. Entries belong to one graph and one graph version: a rebuilt graph or a trip
+#              update (SearchGraph.version) empties the cache on the next lookup.
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import sys
+import threading
+from collections import OrderedDict
+from GTFS_SearchGraph import NoPath
+
+
+class QueryCache(object):
+    '''maxbytes = memory limit of the cached paths and trees (estimated from the container sizes), least recently used
+                  entries are dropped first
+       maxtrees = max number of cached origin trees (0--> paths only)
+       maxtreenodes = trees with more settled nodes are not cached
+       Safe to share between threads, forked workers each fill their own copy.
+    '''
+    def __init__(self, maxbytes=64 << 20, maxtrees=256, maxtreenodes=200000):
+        self.maxbytes = maxbytes
+        self.maxtrees = maxtrees
+        self.maxtreenodes = maxtreenodes
+        self.paths = OrderedDict()  #(o, d, date) -> (cost, path nodes, bytes) in LRU order (oldest first)
+        self.trees = OrderedDict()  #(o, date) -> (dist, pred, bytes, complete) in LRU order, complete--> every node
+                                    #reachable from o is settled (a dijkstra search that ran out of nodes)
+        self.bytes = 0
+        self.graph = None
+        self.version = None
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'treehits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def clear(self):
+        with self.lock:
+            self.paths.clear()
+            self.trees.clear()
+            self.bytes = 0
+
+    def stats(self):
+        #counters and current size, hits = path hits, treehits = answered from the tree of the origin
+        with self.lock:
+            result = dict(self.counts)
+            result.update({'paths': len(self.paths), 'trees': len(self.trees), 'bytes': self.bytes,
+                           'maxbytes': self.maxbytes, 'version': self.version})
+        return result
+
+    def _check(self, G):
+        #drops everything cached for another graph or an older version of it (lock held)
+        if G is not self.graph or G.version <> self.version:
+            if self.paths or self.trees:
+                self.counts['invalidations'] += 1
+            self.paths.clear()
+            self.trees.clear()
+            self.bytes = 0
+            self.graph, self.version = G, G.version
+
+    def _evict(self):
+        #oldest entries first, paths before trees (a tree answers many paths)
+        while self.bytes > self.maxbytes and (self.paths or self.trees):
+            entries = self.paths if self.paths else self.trees
+            self.bytes -= entries.popitem(last=False)[1][2]
+            self.counts['evictions'] += 1
+
+    def shortestPath(self, G, o, d, active=None, date=''):
+        '''G = SearchGraph, o, d = nodes or 'trip_id^stop_id' names
+           active = serviceMask() of the query date, date = its key (the same date always gives the same mask)
+           returns (cost, list of nodes) as G.shortestPath, the list is shared with the cache (do not modify it)
+        '''
+        if not isinstance(o, (int, long)):
+            o = G.nodeId(o)
+        if not isinstance(d, (int, long)):
+            d = G.nodeId(d)
+        pathkey, treekey = (o, d, date), (o, date)
+        with self.lock:
+            self._check(G)
+            entry = self.paths.get(pathkey)
+            if entry is not None:
+                del self.paths[pathkey]
+                self.paths[pathkey] = entry     #--> most recently used
+                self.counts['hits'] += 1
+                return entry[0], entry[1]
+            tree = self.trees.get(treekey)
+            if tree is not None and (d in tree[0] or tree[3]):
+                del self.trees[treekey]
+                self.trees[treekey] = tree
+                self.counts['treehits'] += 1
+                if d not in tree[0]:
+                    raise NoPath('No path between %s and %s' % (G.nodeName(o), G.nodeName(d)))
+                result = (tree[0][d], G.path(tree[1], d))
+                self._putPath(pathkey, result)
+                return result
+            self.counts['misses'] += 1
+            version = G.version
+        #--> search outside the lock, other threads keep answering from the cache
+        dist, pred, reached = G.dijkstra(o, d, active=active)
+        result = (dist[d], G.path(pred, d)) if reached is not None else None
+        with self.lock:
+            self._check(G)
+            if version == self.version:
+                self._putTree(treekey, dist, pred, reached is None)
+                if result is not None:
+                    self._putPath(pathkey, result)
+        if result is None:
+            raise NoPath('No path between %s and %s' % (G.nodeName(o), G.nodeName(d)))
+        return result
+
+    def _putPath(self, key, result):
+        size = sys.getsizeof(result[1]) + 64
+        if key in self.paths:
+            self.bytes -= self.paths.pop(key)[2]
+        self.paths[key] = (result[0], result[1], size)
+        self.bytes += size
+        self._evict()
+
+    def _putTree(self, key, dist, pred, complete):
+        #keeps the larger of the cached and the new tree of the origin (both settle exact costs)
+        if not self.maxtrees or len(dist) > self.maxtreenodes:
+            return
+        old = self.trees.get(key)
+        if old is not None:
+            if len(old[0]) >= len(dist):
+                return
+            self.bytes -= self.trees.pop(key)[2]
+        size = sys.getsizeof(dist) + sys.getsizeof(pred)
+        if size > self.maxbytes:
+            return
+        self.trees[key] = (dist, pred, size, complete)
+        self.bytes += size
+        while len(self.trees) > self.maxtrees:
+            self.bytes -= self.trees.popitem(last=False)[1][2]
+            self.counts['evictions'] += 1
+        self._evict()
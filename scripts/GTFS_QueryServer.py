@@ -0,0 +1,227 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS query server
+# Purpose:     XML-RPC server for the route server functions that answers requests concurrently, either with a pool
+#              of threads or with pre-forked worker processes that share the read-only search graph (copy on write
+#              after the build, or the same mmap'ed snapshot pages). Requests are limited by a timeout and the
+#              server shuts down gracefully on the Quit call or SIGTERM/SIGINT, letting running requests finish.
+#              The latency of every call is recorded per method (querystats, per worker process in 'fork' mode).
+#              Calls hold a readers-writer lock for reading, so a refresh that changes the graph (trip updates) can
+#              take it for writing and never runs while another thread searches.
+#
+# Dependencies: standard python modules only, mode='fork' needs os.fork (not on Windows)
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import os
+import signal
+import time
+import threading
+import Queue
+from contextlib import contextmanager
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+from GTFS_Stats import QueryStats
+
+
+class RequestTimeout(Exception):
+    '''raised in a forked worker when a request runs longer than the request timeout'''
+    pass
+
+
+def _raiseTimeout(signum, frame):
+    raise RequestTimeout('Request took longer than the request timeout')
+
+
+class ReadWriteLock(object):
+    '''any number of readers or one writer, a waiting writer keeps new readers out so a steady stream of requests
+       cannot starve it, not reentrant (a reader must not ask for writing)
+       with lock.reading(): ... / with lock.writing(): ...
+    '''
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting = 0    #--> writers waiting for the readers to finish
+
+    @contextmanager
+    def reading(self):
+        with self.cond:
+            while self.writer or self.waiting:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if not self.readers:
+                    self.cond.notifyAll()
+
+    @contextmanager
+    def writing(self):
+        with self.cond:
+            self.waiting += 1
+            while self.writer or self.readers:
+                self.cond.wait()
+            self.waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer = False
+                self.cond.notifyAll()
+
+
+class QueryServer(SimpleXMLRPCServer):
+    '''addr = (host, port) to listen on
+       workers = number of worker threads/processes
+       mode = 'thread'--> pool of threads in this process (the python GIL lets only one search run at a time, so this
+                          mainly keeps slow clients from blocking others)
+            = 'fork'  --> pre-forked worker processes all accepting on the same socket, throughput grows with cores
+       timeout = request timeout in secs, in 'fork' mode a request running longer is aborted with a fault, in
+                 'thread' mode it limits the time waiting on the client socket
+       poll = how often (secs) idle workers check for shutdown
+       refresh = function called before every request in the worker handling it (e.g. to pick up trip updates)
+       lock = ReadWriteLock held for reading during every call (outside refresh, which may take it for writing),
+              None--> a lock of its own
+    '''
+    allow_reuse_address = True
+
+    def __init__(self, addr, workers=4, mode='thread', timeout=300, poll=0.5, refresh=None, lock=None):
+        SimpleXMLRPCServer.__init__(self, addr, logRequests=False, allow_none=True)
+        if mode == 'fork' and not hasattr(os, 'fork'):
+            print 'Forked workers are not available on this platform, using threads'
+            mode = 'thread'
+        self.workers = workers
+        self.mode = mode
+        self.requesttimeout = timeout
+        self.timeout = poll     #--> used by handle_request() to wake up and check stopping
+        self.stopping = False
+        self.children = []
+        self.refresh = refresh
+        self.lock = lock if lock is not None else ReadWriteLock()
+        self.querystats = QueryStats()
+        self.register_function(self.quit, 'Quit')
+
+    def _dispatch(self, method, params):
+        if self.refresh is not None:
+            self.refresh()
+        ts = time.time()
+        error = True
+        try:
+            with self.lock.reading():
+                result = SimpleXMLRPCServer._dispatch(self, method, params)
+            error = False
+            return result
+        finally:
+            self.querystats.record(method, time.time() - ts, error)
+
+    def quit(self):
+        #Quit call: stop accepting requests, running requests are finished first
+        self.stopping = True
+        if self.mode == 'fork':
+            os.kill(os.getppid(), signal.SIGTERM)   #--> called in a worker process, the parent stops all workers
+        return 1
+
+    def _stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        conn.setblocking(1)
+        conn.settimeout(self.requesttimeout)
+        return conn, addr
+
+    def process_request(self, request, client_address):
+        if self.mode == 'thread':
+            self.queue.put((request, client_address))
+            return
+        signal.setitimer(signal.ITIMER_REAL, self.requesttimeout)
+        try:
+            SimpleXMLRPCServer.process_request(self, request, client_address)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    def _worker(self):
+        #thread mode: handles requests queued by process_request until a None is queued
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def _loop(self):
+        while not self.stopping:
+            self.handle_request()
+
+    def serve(self):
+        #serves requests until Quit is called or the process gets SIGTERM/SIGINT
+        print 'Serving on ', self.server_address, ' with ', self.workers, ' worker ', 'processes' if self.mode == 'fork' else 'threads'
+        if self.mode == 'fork':
+            self._serveForked()
+        else:
+            self._serveThreaded()
+        self.server_close()
+        print 'Server stopped'
+
+    def _serveThreaded(self):
+        self.queue = Queue.Queue()
+        threads = [threading.Thread(target=self._worker) for i in xrange(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        signal.signal(signal.SIGTERM, self._stop)
+        try:
+            self._loop()
+        except KeyboardInterrupt:
+            self.stopping = True
+        for thread in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            #worker process: serves until SIGTERM from the parent
+            self.children = []
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self._stop)
+            signal.signal(signal.SIGALRM, _raiseTimeout)
+            code = 0
+            try:
+                self._loop()
+            except:
+                code = 1
+            os._exit(code)
+        return pid
+
+    def _serveForked(self):
+        self.socket.setblocking(0)  #--> workers race for each connection, the ones that lose go back to waiting
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self.children = [self._spawn() for i in xrange(self.workers)]
+        while not self.stopping:
+            try:
+                pid, status = os.wait()
+            except OSError:
+                continue    #--> interrupted by a signal
+            if pid in self.children and not self.stopping:
+                print 'Worker ', pid, ' exited with status ', status, ', restarting it'
+                self.children[self.children.index(pid)] = self._spawn()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
@@ -0,0 +1,206 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS RAPTOR (round based query engine for the route server)
+# Purpose:     Answers queries with RAPTOR: trips with the same stop sequence that do not overtake each other form a
+#              pattern with one timetable column per stop, round k scans the patterns serving stops improved in round
+#              k-1 (so round k finds the earliest arrivals with k trips) and walks the transfers.txt footpaths. One
+#              query returns the Pareto set of (arrival, transfers), the transfer penalty is chosen at query time.
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+from array import array
+from math import ceil
+from bisect import bisect_left
+from GTFS_SearchGraph import IDTable
+
+INF = 1 << 30
+
+
+class Raptor(object):
+    '''pattern timetables from the stop_times.txt rows of the valid trips, collected with addStopTime()/addFootpath()
+       and packed by finalize()
+       mintransfer = secs needed to change trips at a stop (1--> the next trip must leave after the arrival)
+    '''
+    def __init__(self, mintransfer=1):
+        self.mintransfer = mintransfer
+        self.trips = IDTable()
+        self.stops = IDTable()
+        self.patternstops = []      #pattern -> array of stop indices
+        self.patterntrips = []      #pattern -> array of trip indices in departure order
+        self.arrcols = []           #pattern -> list of arrays, arrival of every trip at each stop position
+        self.depcols = []           #pattern -> list of arrays, departure of every trip at each stop position
+        self.stoppatterns = {}      #stop index -> list of (pattern, stop position)
+        self.footpaths = {}         #stop index -> dict stop index -> walk secs
+        self.tripservice = array('i')   #trip index -> service index (graphs covering the whole feed period only)
+        self._triptimes = {}        #trip index -> list of (stop index, arrival, departure) until finalize()
+
+    def __str__(self):
+        return 'raptor, %d patterns, %d trips' % (len(self.patternstops), len(self.trips))
+
+    def addStopTime(self, trip_id, stop_id, arrtm, deptm):
+        #stop_times.txt rows in file order, rows without times are left out of the trip
+        if arrtm is None or deptm is None:
+            return
+        tix = self.trips.intern(trip_id)
+        self._triptimes.setdefault(tix, []).append((self.stops.intern(stop_id), arrtm, deptm))
+
+    def addFootpath(self, from_stop, to_stop, walk):
+        #walk = walk secs from from_stop to to_stop (e.g. transfers.txt min_transfer_time), the shortest is kept
+        paths = self.footpaths.setdefault(self.stops.intern(from_stop), {})
+        six = self.stops.intern(to_stop)
+        paths[six] = min(paths.get(six, INF), int(ceil(walk)))
+
+    def setServices(self, tripservices, services):
+        #tripservices = dict trip_id -> service_id, services = IDTable of the service_ids (SearchGraph.services) so
+        #the same serviceMask() works for all engines
+        self.tripservice = array('i', [services.get(tripservices[self.trips.names[t]], -1) for t in xrange(len(self.trips))])
+
+    def finalize(self):
+        #groups the trips by stop sequence and splits the groups so that no trip overtakes another (sorted columns)
+        triptimes = self._triptimes
+        groups = {}
+        for tix, rows in triptimes.iteritems():
+            if len(rows) > 1:
+                groups.setdefault(tuple(six for six, arr, dep in rows), []).append(tix)
+        for seq, trips in groups.iteritems():
+            trips.sort(key=lambda tix: triptimes[tix][0][2])
+            patterns = []
+            for tix in trips:
+                rows = triptimes[tix]
+                for pattern in patterns:
+                    last = triptimes[pattern[-1]]
+                    if all(arr >= larr and dep >= ldep for (six, arr, dep), (lsix, larr, ldep) in zip(rows, last)):
+                        pattern.append(tix)
+                        break
+                else:
+                    patterns.append([tix])
+            for pattern in patterns:
+                p = len(self.patternstops)
+                self.patternstops.append(array('i', seq))
+                self.patterntrips.append(array('i', pattern))
+                self.arrcols.append([array('i', [triptimes[tix][i][1] for tix in pattern]) for i in xrange(len(seq))])
+                self.depcols.append([array('i', [triptimes[tix][i][2] for tix in pattern]) for i in xrange(len(seq))])
+                for i, six in enumerate(seq):
+                    self.stoppatterns.setdefault(six, []).append((p, i))
+        self._triptimes = {}
+        return self
+
+    def query(self, source, target, t, maxrounds=5, active=None):
+        '''source, target = stop_ids
+           t = earliest departure from source in secs
+           maxrounds = max number of trips (rounds)
+           active = serviceMask() of the query date (None--> all trips)
+           returns the Pareto set of journeys as list of (arrival secs, transfers, legs), fewest transfers first, legs =
+           list of (trip_id, from stop_id, departure secs, to stop_id, arrival secs) with trip_id None for walks
+        '''
+        src, tgt = self.stops.get(source), self.stops.get(target)
+        if src is None or tgt is None or src == tgt:
+            return []
+        patternstops, patterntrips, arrcols, depcols = self.patternstops, self.patterntrips, self.arrcols, self.depcols
+        stoppatterns, footpaths, mintransfer = self.stoppatterns, self.footpaths, self.mintransfer
+        tripservice = self.tripservice if active is not None and len(self.tripservice) else None
+        ready = [INF]*len(self.stops)   #--> earliest time a trip can be boarded at the stop (any round so far)
+        ready[src] = t
+        labels = [{}]                   #round -> stop -> (pattern, trip, board position, alight position, walked from)
+        best = INF                      #--> earliest arrival at target so far
+        journeys = []
+        marked = set([src])
+        for b, w in footpaths.get(src, {}).iteritems():
+            ready[b] = t + w
+            labels[0][b] = (-1, -1, -1, -1, src)
+            marked.add(b)
+            if b == tgt:
+                best = t + w
+                journeys.append((best, 0, self._legs(labels, 0, tgt, labels[0][b], t)))
+        for k in xrange(1, maxrounds+1):
+            if not marked:
+                break
+            queue = {}
+            for s in marked:
+                for p, i in stoppatterns.get(s, ()):
+                    if queue.get(p, INF) > i:
+                        queue[p] = i    #--> scan each pattern once from the first marked stop
+            prevready = ready[:]
+            label = {}
+            targetlabel = None
+            reached = {}                #stop -> arrival by a trip in this round
+            for p, i0 in queue.iteritems():
+                pstops, arrs, deps, ptrips = patternstops[p], arrcols[p], depcols[p], patterntrips[p]
+                trip = board = -1
+                for i in xrange(i0, len(pstops)):
+                    s = pstops[i]
+                    if trip >= 0:
+                        at = arrs[i][trip]
+                        if at < best:
+                            if s == tgt:
+                                best = at
+                                targetlabel = (p, trip, board, i, -1)
+                            if at + mintransfer < ready[s]:
+                                ready[s] = at + mintransfer
+                                label[s] = (p, trip, board, i, -1)
+                                reached[s] = at
+                    r = prevready[s]
+                    if r < INF and (trip < 0 or r <= deps[i][trip]):
+                        #--> an earlier trip can be caught at this stop
+                        col = deps[i]
+                        j = bisect_left(col, r)
+                        if tripservice is not None:
+                            while j < len(col) and not active[tripservice[ptrips[j]]]:
+                                j += 1
+                        if j < len(col) and (trip < 0 or j < trip):
+                            trip, board = j, i
+            marked = set(reached)
+            triplabels = dict((s, label[s]) for s in reached)
+            for s, at in reached.iteritems():
+                for b, w in footpaths.get(s, {}).iteritems():
+                    if at + w < best:
+                        if b == tgt:
+                            best = at + w
+                            targetlabel = triplabels[s][:4] + (s,)
+                        if at + w < ready[b]:
+                            ready[b] = at + w
+                            label[b] = triplabels[s][:4] + (s,)
+                            marked.add(b)
+            labels.append(label)
+            if targetlabel is not None:
+                journeys.append((best, k-1, self._legs(labels, k, tgt, targetlabel, t)))
+        result = []
+        for arrival, transfers, legs in journeys:
+            #--> a walk only journey is dominated by a direct trip arriving earlier
+            if not [x for x in journeys if x[0] < arrival and x[1] <= transfers]:
+                result.append((arrival, transfers, legs))
+        return result
+
+    def _legs(self, labels, k, stop, label, t):
+        #walks the labels back from the target stop reached in round k to the source
+        names, tripnames = self.stops.names, self.trips.names
+        legs = []
+        while label is not None:
+            p, trip, board, alight, walkfrom = label
+            if walkfrom >= 0:
+                walkdep = t if p < 0 else self.arrcols[p][alight][trip]
+                legs.append((None, names[walkfrom], walkdep, names[stop], walkdep + self.footpaths[walkfrom][stop]))
+            if p < 0:
+                break
+            legs.append((tripnames[self.patterntrips[p][trip]], names[self.patternstops[p][board]], self.depcols[p][board][trip],
+                         names[self.patternstops[p][alight]], self.arrcols[p][alight][trip]))
+            stop = self.patternstops[p][board]
+            label = None
+            for k in xrange(k-1, -1, -1):
+                if labels[k].has_key(stop):
+                    label = labels[k][stop]
+                    break
+        legs.reverse()
+        return legs
+
+
+def bestJourney(journeys, xferpen):
+    '''journeys = Raptor.query() result
+       xferpen = transfer penalty in secs chosen at query time
+       returns the journey with the lowest arrival + xferpen * transfers (None if there is none)
+    '''
+    if not journeys:
+        return None
+    return min(journeys, key=lambda x: (x[0] + xferpen*x[1], x[1]))
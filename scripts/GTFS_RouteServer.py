@@ -1,14 +1,15 @@
 #-----------------------------------------------------------------------------------------------------------------------
 # Name:        GTFS route server version 1.0 (server side script)
-# Purpose:     Generates a search graph as edge list that may be used to perform large scale timetable based route searches
-#              on GTFS data. Depends on NetworkX (http://networkx.github.io/documentation/networkx-1.9.1/index.html)
-#              for shortest path searches in addition to other standard python modules, the search graph in generated
-#              is generic so it can be used with any other graph search library if desired.
+# Purpose:     Generates a search graph that may be used to perform large scale timetable based route searches on GTFS
+#              data. The graph is stored as compact CSR arrays and searched with the Dijkstra of GTFS_SearchGraph
+#              (standard python modules only), it can be exported to NetworkX (G.toNetworkX()) or any other graph
+#              search library if desired.
 # Author:      Chetan Joshi, Portland OR
 #
 # Created:     6/12/2015
 #
-# Dependencies: networkx module for running graph search efficiently is required, xmlrpc is used for running the query  
+# Dependencies: GTFS_SearchGraph (compact CSR graph + Dijkstra) is used for the graph search, networkx is only needed
+#              to export the graph (G.toNetworkX()), xmlrpc is used for running the query
 #
 # Copyright:   (c) Chetan Joshi 2015
 # Licence:     Permission is hereby granted, free of charge, to any person obtaining a copy
@@ -34,109 +35,492 @@ import csv
 import time, os
 import ast
 from math import *
-import networkx as nx
-start = time.time()
-from SimpleXMLRPCServer import SimpleXMLRPCServer
-server = SimpleXMLRPCServer(("localhost", 8000))
-
-def computeGCD(lat1,lon1,lat2,lon2):
-    #computes great circle distance from lat/lon
-    '''lat1/lon1 = lat/lon of first pt
-       lat2/lon2 = lat/lon of second pt
-    '''
-    degRad = pi/180
-    lat1 = degRad*lat1
-    lon1 = degRad*lon1
-    lat2 = degRad*lat2
-    lon2 = degRad*lon2
-    dellambda = lon2-lon1
-    Numerator = sqrt((cos(lat2)*sin(dellambda))**2 + (cos(lat1)*sin(lat2)- sin(lat1)*cos(lat2)*cos(dellambda))**2)
-    Denominator = sin(lat1)*sin(lat2) + cos(lat1)*cos(lat2)*cos(dellambda)
-    delSigma = atan2(Numerator,Denominator)
-
-    return 3963.19059*delSigma
+from array import array
+from bisect import bisect_left, bisect_right
+from GTFS_SearchGraph import SearchGraph, StopTrips, EventTimes, NoPath
+from GTFS_SpatialIndex import computeGCD, StopIndex
+from GTFS_FeedReader import GTFSFeed, ServiceCalendar, stopTimes, tripUpdates, parseTime, formatTime
+from GTFS_Snapshot import feedKey, saveSnapshot, loadSnapshot
+from GTFS_ConnectionScan import ConnectionScan
+from GTFS_Raptor import Raptor, bestJourney
+from GTFS_QueryCache import QueryCache
+from GTFS_Stats import PhaseTimer, peakMemory
+from GTFS_QueryServer import QueryServer, ReadWriteLock
 
 def getCandidateStops(oPoint, dPoint, stopdata, maxDist):
     '''oPoint = tuple/list of origin lat/lon
        dPoint = tuple/list of destination lat/lon
-       stopdata = stopdata dictionary with -> key:stop_id, values[stop_name, stop_lat, stop_lon]
+       stopdata = StopIndex built once from stopdata (a stopdata dictionary with -> key:stop_id, values[stop_name, stop_lat, stop_lon]
+                  is also accepted but then indexed on every call)
        maxDist = max cutoff distance for search
        returns a dict with list stopID -> walk time, stop(lat/lon)
     '''
-    oStopIDs = {}
-    dStopIDs = {}
-    for stopid in stopdata.keys():
-        dist = computeGCD(oPoint[0],oPoint[1],stopdata[stopid][1],stopdata[stopid][2])
-        if  dist < maxDist:
-            oStopIDs[stopid] = [dist*3600/3.0, (stopdata[stopid][1], stopdata[stopid][2])]
-            
-        dist = computeGCD(dPoint[0],dPoint[1],stopdata[stopid][1],stopdata[stopid][2])
-        if  dist < maxDist:
-            dStopIDs[stopid] = [dist*3600/3.0, (stopdata[stopid][1], stopdata[stopid][2])]
-    return oStopIDs, dStopIDs
+    if not isinstance(stopdata, StopIndex):
+        stopdata = StopIndex(stopdata)
+    return stopdata.candidateStops(oPoint, dPoint, maxDist)
+
+def getCandidateStopsBatch(points, stopindex, maxDist):
+    '''points = list of lat/lon tuples (e.g. trip origins)
+       stopindex = StopIndex built from stopdata
+       maxDist = max cutoff distance for search
+       returns a list with one dict stopID -> walk time, stop(lat/lon) per point
+    '''
+    return stopindex.batchCandidates(points, maxDist)
+
 
+def _initTransferWorker(stopindex, maxDist):
+    #process pool initializer for createTransferFile, the index is sent once per worker
+    global _xferindex, _xferdist
+    _xferindex = stopindex
+    _xferdist = maxDist
 
-def createTransferFile(dir, maxDist, stopsfile=r'\stops.txt', transferfile=r'\transfers.txt'):
+def _transferRows(ixs):
+    #transfer rows [from_stop_id, to_stop_id, transfer_type, min_transfer_time] for a chunk of stops in _xferindex
+    rows = []
+    for i in ixs:
+        oStop = _xferindex.stopids[i]
+        for j, dist in _xferindex.near((_xferindex.lats[i], _xferindex.lons[i]), _xferdist, inclusive=True):
+            if j <> i:
+                rows.append([oStop, _xferindex.stopids[j], 0, int(floor(dist*1200*1.25))])
+    return rows
+
+def createTransferFile(dir, maxDist, stopsfile='stops.txt', transferfile='transfers.txt', xfertime=True, processes=1, chunksize=500):
     #utility to create a stop to stop transfer file is it does not already exist with the GTFS file set
-    #calculation method is not very clever so running time may get prohibitive if too many stops
-    '''dir = directory path where files are stored
+    #stops are bucketed in a StopIndex so only nearby stops are measured, rows are written out chunk by chunk
+    '''dir = directory path where files are stored (or GTFS zip archive, the transfer file is then written next to it)
     maxDist = maximum walk distance in miles
     stopsfile = name of the file where stop data is stored - see GTFS stops.txt for format also default name
     transferfile = name of the file where transfer data is stopred - see GTFS transfers.txt for format also default name
+    xfertime = also write min_transfer_time (walk time in secs, used by BuildSearchGraph instead of recomputing it)
+    processes = number of worker processes for the neighbor search (1 -> run in this process)
+    chunksize = number of origin stops handled per work unit
     '''
     print 'Generating transfer file from user spec...'
     ts1 = time.time()
-    fn = open(dir+stopsfile, 'rb')
-    reader = csv.reader(fn, delimiter=',')
-    atts = reader.next()
-    attix = dict(zip(atts, range(len(atts))))
+    feed = GTFSFeed(dir)
+    attix, reader = feed.table(stopsfile.lstrip('\\/'))
     #print attix
     stopdata = {}
     for row in reader:
         stopdata[row[attix['stop_id']]] = [row[attix['stop_name']], float(row[attix['stop_lat']]), float(row[attix['stop_lon']])]
-    fn.close()
+    feed.close()
+
+    stopindex = StopIndex(stopdata)
+    del stopdata
+    chunks = [xrange(i, min(i+chunksize, len(stopindex))) for i in xrange(0, len(stopindex), chunksize)]
+    if processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes, _initTransferWorker, (stopindex, maxDist))
+        results = pool.imap(_transferRows, chunks)
+    else:
+        pool = None
+        _initTransferWorker(stopindex, maxDist)
+        results = (_transferRows(chunk) for chunk in chunks)
 
-    calctransfer = [['from_stop_id','to_stop_id','transfer_type']]
-    oStops = stopdata.keys()
-    dStops = stopdata.keys()
-    for oStop in oStops:
-        oStopLat = stopdata[oStop][1]
-        oStopLon = stopdata[oStop][2]
-        for dStop in dStops:
-            dStopLat = stopdata[dStop][1]
-            dStopLon = stopdata[dStop][2]
-            dist = computeGCD(oStopLat,oStopLon,dStopLat,dStopLon)
-            if dist <= maxDist and oStop <> dStop:
-                calctransfer.append([oStop, dStop, 0])
-
-    fn = open(dir+transferfile, 'wb')
+    fn = open(os.path.join(dir if feed.zip is None else os.path.dirname(dir), transferfile.lstrip('\\/')), 'wb')
     writer = csv.writer(fn)
-    writer.writerows(calctransfer)
+    if xfertime:
+        writer.writerow(['from_stop_id','to_stop_id','transfer_type','min_transfer_time'])
+    else:
+        writer.writerow(['from_stop_id','to_stop_id','transfer_type'])
+    cnt = 0
+    for rows in results:
+        if not xfertime:
+            rows = [row[:3] for row in rows]
+        writer.writerows(rows)
+        cnt += len(rows)
     fn.close()
-    del calctransfer, stopdata
-    print 'Finised generating transfer file from user spec in ',time.time()-ts1, ' secs'
+    if pool is not None:
+        pool.close()
+        pool.join()
+    print 'Finised generating transfer file from user spec in ',time.time()-ts1, ' secs ', cnt, ' transfers'
+
+
+def getStopTable(G, stop_id, validtrips):
+    '''G = SearchGraph being built (after indexStops) or patched
+       stop_id = stop of the events
+       returns parallel arrays (arrivals, departures, nodes, route ids) of the events at the stop in departure order
+    '''
+    lo, hi = G.stopRange(stop_id)
+    while lo < hi and G.stopdeps[lo] < 0:
+        lo += 1     #--> events of cancelled trips (time -1) sort first
+    nodes = G.stopevents[lo:hi]
+    tripnames, nodetrip = G.trips.names, G.nodetrip
+    return G.stoparrs[lo:hi], G.stopdeps[lo:hi], nodes, [validtrips[tripnames[nodetrip[node]]] for node in nodes]
+
+def addTransferEdges(G, otable, dtable, wlktim, lim, xferpen):
+    '''adds transfer edges from every arrival in otable to departures in dtable (see getStopTable)
+       a departure qualifies if it leaves after arrival + wlktim, less than lim secs after the arrival and on another route,
+       the window is found with bisect on the departure times so only candidate departures are looked at
+       returns the number of edges added
+    '''
+    oarrs, odeps, onodes, oroutes = otable
+    darrs, ddeps, dnodes, droutes = dtable
+    cnt = 0
+    for i in xrange(len(oarrs)):
+        oarr = oarrs[i]
+        oroute = oroutes[i]
+        for j in xrange(bisect_right(ddeps, oarr+wlktim), bisect_left(ddeps, oarr+lim)):
+            if droutes[j] <> oroute: #--> no need to create transfer on same route id
+                G.addEdge(onodes[i], dnodes[j], max(60, ddeps[j] - oarr)+xferpen)
+                cnt += 1
+    return cnt
+
+def getWaitChains(G, stop_id, validtrips, tripdir):
+    '''waiting chains of a stop: one chain of virtual wait nodes per (route, direction) at the stop, every wait node
+       boards its departure (0 secs) or waits for the next departure of the chain (headway secs)
+       tripdir = dict trip_id -> direction_id
+       returns dict (route id, direction id) -> (departures, nodes, wait nodes) in departure order and the edges added
+    '''
+    deps = {}
+    lo, hi = G.stopRange(stop_id)
+    for p in xrange(lo, hi):
+        node = G.stopevents[p]
+        stp = G.trips.names[G.nodetrip[node]]
+        deps.setdefault((validtrips[stp], tripdir.get(stp, '')), []).append((G.stopdeps[p], node))
+    chains = {}
+    cnt = 0
+    for key, chain in deps.iteritems():
+        waits = [G.addNode(stop_id) for dep, node in chain]
+        for k in xrange(len(chain)):
+            G.addEdge(waits[k], chain[k][1], 0)
+            if k > 0:
+                G.addEdge(waits[k-1], waits[k], chain[k][0] - chain[k-1][0])
+        cnt += 2*len(chain) - 1
+        chains[key] = ([dep for dep, node in chain], [node for dep, node in chain], waits)
+    return chains, cnt
+
+def addWaitEdges(G, otable, dchains, wlktim, lim, xferpen):
+    '''adds an edge from every arrival in otable to the wait node of the first departure per (route, direction) in
+       dchains (see getWaitChains) that leaves after arrival + wlktim and at least lim secs after the arrival, on another
+       route, the later departures of the chain are reached through it at the same cost as by their own edge
+       returns the number of edges added
+    '''
+    oarrs, odeps, onodes, oroutes = otable
+    cnt = 0
+    for i in xrange(len(oarrs)):
+        oarr = oarrs[i]
+        oroute = oroutes[i]
+        for (route, direction), (deps, nodes, waits) in dchains.iteritems():
+            if route <> oroute:
+                j = max(bisect_right(deps, oarr+wlktim), bisect_left(deps, oarr+lim))
+                if j < len(deps):
+                    G.addEdge(onodes[i], waits[j], deps[j] - oarr + xferpen)
+                    cnt += 1
+    return cnt
+
+def addPrunedTransferEdges(G, otable, dchains, wlktim, lim, xferpen):
+    '''pruned version of addTransferEdges plus addWaitEdges, an arrival only connects to the first departure per
+       (route, direction) in dchains (see getWaitChains) that is at least 60 secs away, later departures are reached
+       through the chain at the same cost (departures less than 60 secs away keep their own edge as they cost the
+       60 secs minimum)
+       returns the number of edges added and the number addTransferEdges plus addWaitEdges would have added
+    '''
+    oarrs, odeps, onodes, oroutes = otable
+    cnt = 0
+    full = 0
+    for i in xrange(len(oarrs)):
+        oarr = oarrs[i]
+        oroute = oroutes[i]
+        for (route, direction), (deps, nodes, waits) in dchains.iteritems():
+            if route == oroute: #--> no need to create transfer on same route id
+                continue
+            j = bisect_right(deps, oarr+wlktim)
+            hi = bisect_left(deps, oarr+lim)
+            full += max(0, hi - j) + (1 if max(j, hi) < len(deps) else 0)
+            while j < len(deps) and deps[j] - oarr < 60:
+                G.addEdge(onodes[i], nodes[j], 60+xferpen)
+                cnt += 1
+                j += 1
+            if j < len(deps):
+                G.addEdge(onodes[i], waits[j], deps[j] - oarr + xferpen)
+                cnt += 1
+    return cnt, full
+
 
+xferlim = 4800  #--> transfers reach the departures less than xferlim secs after an arrival by their own edge and
+                #    the later ones through the waiting chains of the stop (so waits are never capped)
 
-def BuildSearchGraph(dir, xferpen, calmethod, date='', day=''):
-    '''dir = directory path of the GTFS file set
+def addStopTransfers(G, stop_id, stoptables, stopchains, footpaths, xferpen, otable=None):
+    '''adds the transfer edges leaving the events at stop_id, within the stop and along its transfers.txt footpaths
+       stoptables = dict stop_id -> getStopTable()
+       stopchains = dict stop_id -> getWaitChains()
+       footpaths = dict from stop_id -> list of (to stop_id, walk secs) in transfers.txt order
+       otable = getStopTable() columns of the events to add edges for, None--> every event at the stop
+       G.pruned = True--> only the first departure per waiting chain (addPrunedTransferEdges), False--> every departure
+                  less than lim secs after an arrival (addTransferEdges) and the first later one per chain (addWaitEdges)
+       returns [transfer edges added, transfer edges without pruning]
+    '''
+##    avghw = 24*60/len(strps)
+##    if avghw < 15:
+##        lim = 2400
+##    else:
+##        lim = 3600
+    lim = xferlim
+    if otable is None:
+        otable = stoptables[stop_id]
+    cnt = [0, 0]
+    for to_stop, wlktim in [(stop_id, 0)] + footpaths.get(stop_id, []):
+        if G.pruned:
+            added, full = addPrunedTransferEdges(G, otable, stopchains[to_stop], wlktim, lim, xferpen)
+        else:
+            added = full = addTransferEdges(G, otable, stoptables[to_stop], wlktim, lim, xferpen) + \
+                           addWaitEdges(G, otable, stopchains[to_stop], wlktim, lim, xferpen)
+        cnt[0] += added
+        cnt[1] += full
+    return cnt
+
+_buildstate = None
+
+def _transferEdges(stops):
+    #addStopTransfers for a chunk of stops in a forked build worker, the edges go back as raw array strings
+    G, stoptables, stopchains, footpaths, xferpen = _buildstate
+    G.clearEdges()  #--> drops the edges inherited from the parent (without copying them as takeEdges would)
+    cnt = [0, 0]
+    for stop_id in stops:
+        added, full = addStopTransfers(G, stop_id, stoptables, stopchains, footpaths, xferpen)
+        cnt[0] += added
+        cnt[1] += full
+    return G.takeEdges(), cnt
+
+def patchWaitChains(G, stop_id, validtrips, moved=()):
+    '''waiting chains of a stop in a patched graph (see getWaitChains), every wait node keeps the event it boards in
+       the build and a chain runs through the wait nodes of its live departures in departure order (wait nodes of
+       cancelled trips board nothing), so a moved departure leaves the wait nodes of the others where they are
+       moved = events whose times changed, the edges of the chains holding one are added with G.addEdge (for G.patchRows)
+       returns dict (route id, first wait node) -> (departures, nodes, wait nodes) as getWaitChains and the wait nodes
+       of the chains with edges added
+    '''
+    nodedep, nodetrip, tripnames = G.nodedep, G.nodetrip, G.trips.names
+    chains = {}
+    waitnodes = []
+    for chain in G.patchIndex()[1].get(G.stops.get(stop_id), ()):
+        live = sorted((nodedep[event], event, wait) for wait, event in chain if event >= 0 and nodedep[event] >= 0)
+        if any(event in moved for wait, event in chain):
+            for k in xrange(len(live)):
+                G.addEdge(live[k][2], live[k][1], 0)
+                if k > 0:
+                    G.addEdge(live[k-1][2], live[k][2], live[k][0] - live[k-1][0])
+            waitnodes.extend(wait for wait, event in chain)
+        if live:
+            route = validtrips[tripnames[nodetrip[chain[0][1]]]]
+            chains[(route, chain[0][0])] = ([dep for dep, node, wait in live], [node for dep, node, wait in live],
+                                            [wait for dep, node, wait in live])
+    return chains, waitnodes
+
+def patchTripUpdates(G, updates, validtrips, xferpen):
+    '''G = finalized SearchGraph (built or loaded from a snapshot)
+       updates = dict trip_id -> None (cancelled) or list of (stop_id, arrival delay, departure delay) as returned by
+                 tripUpdates(), the full set in effect (trips no longer listed go back to their timetable times)
+       xferpen = transfer penalty the graph was built with
+       moves the event times of the trips whose update changed (delayed times never go back along the trip) and
+       re-sorts the departures of the stops they touch, then rebuilds the out edges of their events, of the arrivals
+       (at those stops or at stops with footpaths to them) with the old or new departure of a moved event within their
+       transfer window or entering its waiting chain before it and of the waiting chains holding a moved event, as a
+       rebuild of the feed with the new times would
+       returns dict with the numbers of changed trips, skipped trips (not in the graph), touched stops, patched rows
+       and the graph version
+    '''
+    ts = time.time()
+    nodearr, nodedep, nodestop, nodetrip, scheduled = G.nodearr, G.nodedep, G.nodestop, G.nodetrip, G.scheduled
+    tripevents, chains, footin = G.patchIndex()
+    previous = G.tripupdates
+    changed = [trip_id for trip_id in set(previous) | set(updates) if previous.get(trip_id, ()) <> updates.get(trip_id, ())]
+    touched = set()
+    rownodes = set()
+    moved = {}                      #--> event -> departure before the patch, of the events whose times change
+    skipped = 0
+    for trip_id in changed:
+        tix = G.trips.get(trip_id)
+        if tix is None:
+            skipped += 1
+            continue
+        update = updates.get(trip_id, ())
+        if update is not None:
+            delays = dict((G.stops.get(stop_id), (arrdelay, depdelay)) for stop_id, arrdelay, depdelay in update)
+        arrdelay = depdelay = 0     #--> delays carry on to the following stops
+        prevdep = 0                 #--> times never go back along the trip
+        for node in tripevents[tix]:
+            arr, dep = scheduled.get(node, (nodearr[node], nodedep[node]))
+            if update is None:
+                newarr = newdep = -1
+            else:
+                delay = delays.get(nodestop[node])
+                if delay is not None:
+                    arrdelay = delay[0] if delay[0] is not None else (delay[1] if delay[1] is not None else depdelay)
+                    depdelay = delay[1] if delay[1] is not None else arrdelay
+                else:
+                    arrdelay = depdelay     #--> stops without an update carry the departure delay before them
+                newarr = max(prevdep, arr + arrdelay) if arr >= 0 else -1
+                newdep = max(prevdep, dep + depdelay, newarr) if dep >= 0 else -1
+                prevdep = max(prevdep, newdep)
+            if (newarr, newdep) <> (arr, dep):
+                scheduled[node] = (arr, dep)
+            else:
+                scheduled.pop(node, None)
+            if (newarr, newdep) <> (nodearr[node], nodedep[node]):
+                moved[node] = nodedep[node]
+            nodearr[node], nodedep[node] = newarr, newdep
+            touched.add(nodestop[node])
+            rownodes.add(node)
+    for trip_id in changed:
+        if updates.has_key(trip_id):
+            G.tripupdates[trip_id] = updates[trip_id]
+        else:
+            G.tripupdates.pop(trip_id, None)
+    stopevents, stoparrs, stopdeps = G.stopevents, G.stoparrs, G.stopdeps
+    for six in touched:
+        lo, hi = G.stopoffsets[six], G.stopoffsets[six+1]
+        events = sorted((stopevents[p] for p in xrange(lo, hi)), key=lambda node: (nodedep[node], node))
+        for p, node in enumerate(events, lo):
+            stopevents[p], stoparrs[p], stopdeps[p] = node, nodearr[node], nodedep[node]
+    #out edges change for the arrivals with the old or new departure of a moved event in their transfer window or
+    #entering its waiting chain after the departure before it (see addWaitEdges)
+    stopnames = G.stops.names
+    deptimes = {}   #stop index -> (departure, departure before it in its chain or None) for old and new departures
+    for six in set(nodestop[node] for node in moved):
+        for chain in chains.get(six, ()):
+            events = [event for wait, event in chain if event >= 0]
+            for node in events:
+                if node not in moved:
+                    continue
+                olddeps = [moved.get(event, nodedep[event]) for event in events if event <> node]
+                newdeps = [nodedep[event] for event in events if event <> node]
+                for dep in (moved[node], nodedep[node]):
+                    if dep >= 0:
+                        before = [max([-1] + [d for d in deps if d < dep]) for deps in (olddeps, newdeps)]
+                        deptimes.setdefault(six, []).append((dep, min(before) if min(before) >= 0 else None))
+    walksto = {}    #stop index -> stop index with moved departures -> shortest walk to it
+    for six in deptimes:
+        walksto.setdefault(six, {})[six] = 0
+        for fsix in footin.get(six, ()):
+            for to_stop, walk in G.footpathsFrom(stopnames[fsix]):
+                if G.stops[to_stop] == six:
+                    walks = walksto.setdefault(fsix, {})
+                    walks[six] = min(walk, walks.get(six, walk))
+    for six, walks in walksto.iteritems():
+        lo, hi = G.stopoffsets[six], G.stopoffsets[six+1]
+        arrivals = sorted((stoparrs[p], stopevents[p]) for p in xrange(lo, hi))
+        arrtimes = [arr for arr, node in arrivals]
+        for dsix, walk in walks.iteritems():
+            for dep, before in deptimes[dsix]:
+                first = bisect_left(arrtimes, before - xferlim - walk) if before is not None else 0
+                for k in xrange(first, bisect_right(arrtimes, dep - walk)):
+                    rownodes.add(arrivals[k][1])
+    rowstops = {}   #stop index -> events at the stop in rownodes
+    for node in rownodes:
+        rowstops.setdefault(nodestop[node], set()).add(node)
+    footpaths = dict((stopnames[six], G.footpathsFrom(stopnames[six])) for six in rowstops)
+    tablestops = set(footpaths)
+    for paths in footpaths.itervalues():
+        tablestops.update(to_stop for to_stop, walk in paths)
+    stoptables = dict((stop_id, getStopTable(G, stop_id, validtrips)) for stop_id in tablestops)
+    stopchains = {}
+    for stop_id in tablestops:
+        stopchains[stop_id], waits = patchWaitChains(G, stop_id, validtrips, moved)
+        rownodes.update(waits)
+    for u in sorted(rownodes):
+        #--> trip edges first as in the build
+        if nodetrip[u] < 0 or nodedep[u] < 0:
+            continue
+        events = tripevents[nodetrip[u]]
+        k = events.index(u)
+        if k+1 < len(events) and nodearr[events[k+1]] >= 0:
+            G.addEdge(u, events[k+1], nodearr[events[k+1]] - nodedep[u])
+    for six, nodes in rowstops.iteritems():
+        otable = stoptables[stopnames[six]]
+        rows = [k for k in xrange(len(otable[2])) if otable[2][k] in nodes]
+        otable = [[column[k] for k in rows] for column in otable]
+        addStopTransfers(G, stopnames[six], stoptables, stopchains, footpaths, xferpen, otable)
+    G.patchRows(rownodes)
+    return {'trips': len(changed) - skipped, 'skipped': skipped, 'stops': len(touched), 'rows': len(rownodes),
+            'version': G.version, 'secs': time.time() - ts}
+
+def getValidServices(feed, calmethod, date='', day=''):
+    '''feed = GTFSFeed
+       calmethod, date, day = as BuildSearchGraph
+       returns validservices (dict to lookup valid service IDs)
+    '''
+    if calmethod == 0:
+        #1.0) every service of the feed period, the services running on a date are picked per query (ServiceCalendar)
+        calendar = ServiceCalendar(feed)
+        validservices = dict.fromkeys(calendar.weekly.keys(), 1)
+        for services in calendar.exceptions.itervalues():
+            validservices.update(dict.fromkeys(services.keys(), 1))
+    elif calmethod == 1:
+        #1.a) get calendar for service id and valid day
+        serviceday, reader = feed.table('calendar.txt')
+        #service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+        validservices = {}
+        for row in reader:
+            if row[serviceday[day]] == '1':
+                validservices[row[serviceday['service_id']]] = 1
+
+    elif calmethod == 2:
+        #1.b) Valid services based on calendar_dates.txt
+        attix, reader = feed.table('calendar_dates.txt')
+        #service_id,date,exception_type
+        validservices = {}
+        for row in reader:
+            if row[attix['date']] == date and row[attix['exception_type']] == '1':
+                validservices[row[attix['service_id']]] = 1
+        #print validservices
+    elif calmethod == 3:
+        #1.c) get calendar for service id and valid day
+        serviceday, reader = feed.table('calendar.txt')
+        #service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+        validservices = {}
+        for row in reader:
+            if row[serviceday[day]] == '1':
+                validservices[row[serviceday['service_id']]] = 1
+
+        attix, reader = feed.table('calendar_dates.txt')
+        #service_id,date,exception_type
+        serviceexcept = {}
+        for row in reader:
+            if row[attix['date']] == date:
+                serviceexcept[row[attix['service_id']]] = row[attix['exception_type']] #1 -> add, 2 --> remove
+        #valid services has all services without exception... now we filter out the ones not applicable to a date...
+        for key in serviceexcept.keys():
+            if serviceexcept[key] == '1':   #1 -> add, 2 --> remove
+                if not validservices.has_key(key):
+                    validservices[key] = 1  # -> insert an added service if it does not already exist
+            elif serviceexcept[key] == '2':
+                if validservices.has_key(key):
+                    validservices.pop(key)  # --> pop out an invalid service for the day
+    return validservices
+
+def BuildSearchGraph(dir, xferpen, calmethod, date='', day='', prune=False, engines=(), processes=1):
+    '''dir = directory path of the GTFS file set or the GTFS zip archive (read directly, no need to extract it)
        xferpen = transfer penalty in seconds - needed for getting fewer transfer in paths
-       calmethod = 1--> use calendar.txt
+       calmethod = 0--> use all trips of the feed period, queries pick the date (date=... on GetRouteTime/GetRouteDetail)
+                 = 1--> use calendar.txt
                  = 2--> use calendar_dates.txt
                  = 3--> use both calendar and calendar_dates 
        day = string input (if calmethod = 1) for day of trip -> 'monday', 'tuesday', 'wednesday' ,'thursday', 'friday', 'saturday', 'sunday'
        date = string input (if calmethod = 2) on date as per GTFS-> YYYYMMDD
-       The function returns: 1) edges (list to build Graph in networkX),
+       prune = True--> only connect arrivals to the first feasible departure per (route, direction) of the waiting chains
+               between consecutive departures at a stop, much fewer edges with the same path costs (both graphs reach
+               the departures more than xferlim secs after an arrival through the chains, so waits are never capped)
+       engines = query engines (ConnectionScan, Raptor) to fill from the same stop_times.txt and transfers.txt pass
+       processes = number of worker processes for the transfer edges (sharded by stop) and the CSR packing (sharded by
+                   node range), 1--> build in this process, the graph is the same either way
+       The function returns: 1) G (SearchGraph of trip_id^stop_id events stored as CSR arrays, G.toNetworkX() for networkx),
                              2) validservices (dict to lookup valid service IDs),
                              3) validtrips (dict to get trips valid that day-> maps to RouteID),
-                             4) stoptrips (dict of services serving a stop),
-                             5) getstopid (dict of trip_id+stop_id -> arrival, departure info),
+                             4) stoptrips (StopTrips view of G, stop_id -> (trip_id, arrival, departure) in departure order),
+                             5) getstopid (EventTimes view of G, trip_id^stop_id -> (stop_id, arrival, departure)),
                              6) stopdata (dict of stop properties)
     '''
-    t0 = time.time()
-    filesindir = set(os.listdir(dir))
-    print 'Files found in directory: ', filesindir
+    timer = PhaseTimer()    #--> per phase secs, peak memory and counts, kept as G.buildstats
+    feed = GTFSFeed(dir)
+    filesindir = feed.files()
+    print 'Files found in feed: ', filesindir
     reqdfiles = ['stops.txt', 'trips.txt', 'stop_times.txt']#, 'transfers.txt']
-    if calmethod == 1:
+    if calmethod == 0:
+        if not filesindir.intersection(['calendar.txt', 'calendar_dates.txt']):
+            reqdfiles.append('calendar.txt')
+    elif calmethod == 1:
         reqdfiles.append('calendar.txt')
     elif calmethod == 2:
         reqdfiles.append('calendar_dates.txt')
@@ -148,268 +532,582 @@ def BuildSearchGraph(dir, xferpen, calmethod, date='', day=''):
     if filesindir.issuperset(reqdfiles):
         filesok=1
         print 'Starting to process feed data...'
-        if calmethod == 1:
-            #1.a) get calendar for service id and valid day
-            fn = open(dir+r'\calendar.txt', 'rb')
-            reader = csv.reader(fn, delimiter=',')
-            atts = reader.next()
-            serviceday = dict(zip(atts, range(len(atts))))
-            #service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
-            validservices = {}
-            for row in reader:
-                if row[serviceday[day]] == '1':
-                    validservices[row[serviceday['service_id']]] = 1
-            fn.close()
-
-        elif calmethod == 2:
-            #1.b) Valid services based on calendar_dates.txt
-            fn = open(dir+r'\calendar_dates.txt', 'rb')
-            reader = csv.reader(fn, delimiter=',')
-            reader.next()
-            #service_id,date,exception_type
-            validservices = {}
-            for row in reader:
-                if row[1] == date and row[2] == '1':
-                    validservices[row[0]] = 1
-            fn.close()
-            #print validservices
-        elif calmethod == 3:
-            #1.c) get calendar for service id and valid day
-            fn = open(dir+r'\calendar.txt', 'rb')
-            reader = csv.reader(fn, delimiter=',')
-            atts = reader.next()
-            serviceday = dict(zip(atts, range(len(atts))))
-            #service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
-            validservices = {}
-            for row in reader:
-                if row[serviceday[day]] == '1':
-                    validservices[row[serviceday['service_id']]] = 1
-            fn.close()
-
-            fn = open(dir+r'\calendar_dates.txt', 'rb')
-            reader = csv.reader(fn, delimiter=',')
-            reader.next()
-            #service_id,date,exception_type
-            serviceexcept = {}
-            for row in reader:
-                if row[1] == date:
-                    serviceexcept[row[0]] = row[2] #1 -> add, 2 --> remove
-            fn.close()
-            #valid services has all services without exception... now we filter out the ones not applicable to a date...
-            for key in serviceexcept.keys():
-                if serviceexcept[key] == '1':   #1 -> add, 2 --> remove
-                    if not validservices.has_key(key):
-                        validservices[key] = 1  # -> insert an added service if it does not already exist
-                elif serviceexcept[key] == '2':
-                    if validservices.has_key(key):
-                        validservices.pop(key)  # --> pop out an invalid service for the day
+        validservices = getValidServices(feed, calmethod, date, day)
 
         #2) get valid trip_id based on valid services
-        fn = open(dir+r'\trips.txt', 'rb')
-        reader = csv.reader(fn, delimiter=',')
-        atts = reader.next()
-        attix = dict(zip(atts, range(len(atts))))
+        attix, reader = feed.table('trips.txt')
         #print attix
         validtrips = {} #gives route id based on trip id
+        tripdir = {}    #gives direction id based on trip id (waiting chains)
+        tripservices = {} #gives service id based on trip id (calmethod 0 only)
         for row in reader:
             if validservices.has_key(row[attix['service_id']]):
                 validtrips[row[attix['trip_id']]]=row[attix['route_id']]
-        fn.close()
+                if calmethod == 0:
+                    tripservices[row[attix['trip_id']]]=row[attix['service_id']]
+                if attix.has_key('direction_id'):
+                    tripdir[row[attix['trip_id']]]=row[attix['direction_id']]
+        timer.mark('services and trips', services=len(validservices), trips=len(validtrips))
         #print validtrips
         #3) now build veh journeys from valid trips
-        fn = open(dir+r'\stop_times.txt', 'rb')
-        reader = csv.reader(fn, delimiter=',')
-        atts = reader.next()
-        attix = dict(zip(atts, range(len(atts))))
-        #print attix
-        stoptrips = {}
-        getstopid = {}
-        edges = []
-        stop_times = []
+        #trip edges are built on the fly from consecutive rows of the same trip, stop_times.txt is never held in memory
+        stopnodes, stoparrs, stopdeps = array('i'), array('i'), array('i')   #--> rows with both times for the stop index
+        G = SearchGraph()
+        G.pruned = prune
         cnt=0
-        for row in reader:
+        prevtrip = prevnode = prevdep = None
+        for trip_id, stop_id, arr, dep, arrtm, deptm in stopTimes(feed, validtrips):
             #this builds stop to stop times for valid trips...
             #trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,shape_dist_traveled
-            if validtrips.has_key(row[attix['trip_id']]):
-                stop_times.append(row)
-                getstopid[row[attix['trip_id']]+'^'+row[attix['stop_id']]]=[row[attix['stop_id']], row[attix['arrival_time']], row[attix['departure_time']]]
+            node = G.addEvent(trip_id, stop_id, arrtm, deptm)
+            if trip_id == prevtrip and prevdep is not None and arrtm is not None:
+                G.addEdge(prevnode, node, arrtm-prevdep)
+            prevtrip, prevnode, prevdep = trip_id, node, deptm
+            for eng in engines:
+                eng.addStopTime(trip_id, stop_id, arrtm, deptm)
             #this builds wihin stop transfers...
-                try:
-                    if stoptrips.has_key(row[attix['stop_id']]):
-                        arr = map(int, row[attix['arrival_time']].split(':'))
-                        arrtm = arr[0]*3600 + arr[1]*60 + arr[2]
-                        dep = map(int, row[attix['departure_time']].split(':'))
-                        deptm = dep[0]*3600 + dep[1]*60 + dep[2]
-                        stoptrips[row[attix['stop_id']]].append([row[attix['trip_id']], arrtm, deptm])
-                    else:
-                        arr = map(int, row[attix['arrival_time']].split(':'))
-                        arrtm = arr[0]*3600 + arr[1]*60 + arr[2]
-                        dep = map(int, row[attix['departure_time']].split(':'))
-                        deptm = dep[0]*3600 + dep[1]*60 + dep[2]
-                        stoptrips[row[attix['stop_id']]]=[[row[attix['trip_id']], arrtm, deptm]]
-                except:
-                    if cnt < 10:
-                        print 'Failed to convert data for row: ', row
-                        cnt+=1
-                    else:
-                        pass
-
-        fn.close()
-        print 'Finished building basic lookups and filtering data: ', time.time() - start, ' secs'
-        start1 = time.time()
-        cnt = 0
-        for i in xrange(0, len(stop_times)-1):
-            if stop_times[i][attix['trip_id']] == stop_times[i+1][attix['trip_id']]:
-                try:
-                    arr = map(int, stop_times[i+1][attix['arrival_time']].split(':'))
-                    arrtm = arr[0]*3600 + arr[1]*60 + arr[2]
-                    dep = map(int, stop_times[i][attix['departure_time']].split(':'))
-                    deptm = dep[0]*3600 + dep[1]*60 + dep[2]
-                    edges.append([stop_times[i][attix['trip_id']]+'^'+stop_times[i][attix['stop_id']],
-                                  stop_times[i+1][attix['trip_id']]+'^'+stop_times[i+1][attix['stop_id']],
-                                  arrtm-deptm])
-                except:
-                    if cnt < 10:
-                        print 'Failed to convert data for row: ', row
-                        cnt+=1
-                    else:
-                        pass
-
-        print 'Finished building line graph: ', time.time() - start1, ' secs ', len(edges), ' edges so far...'
-        del stop_times
-        start2 = time.time()
-
-        for key in stoptrips.keys():
-            strps = stoptrips[key]
-##            avghw = 24*60/len(strps)
-##            if avghw < 15:
-##                lim = 2400
-##            else:
-##                lim = 3600
-            lim = 4800
-            for ostp, oarr, odep in strps:
-                for dstp, darr, ddep in strps:
-                    if oarr < ddep and validtrips[ostp] <> validtrips[dstp]: #--> no need to create transfer on same route id
-                        conntime = max(60, ddep - oarr)
-                        if conntime < lim:
-                            edges.append([ostp+'^'+key, dstp+'^'+key, conntime+xferpen])
-
-        print 'Finished building valid transfers within stops: ', time.time() - start2, ' secs', len(edges), ' edges so far...'
-
-        fn = open(dir+r'\stops.txt', 'rb')
-        reader = csv.reader(fn, delimiter=',')
-        atts = reader.next()
-        attix = dict(zip(atts, range(len(atts))))
+            if arrtm is not None and deptm is not None:
+                stopnodes.append(node)
+                stoparrs.append(arrtm)
+                stopdeps.append(deptm)
+            elif cnt < 10:
+                print 'Failed to convert data for row: ', [trip_id, arr, dep, stop_id]
+                cnt+=1
+
+        G.indexStops(stopnodes, stoparrs, stopdeps)   #--> events of every stop in departure order
+        del stopnodes, stoparrs, stopdeps
+        stoptrips = StopTrips(G)
+        getstopid = EventTimes(G)
+        secs = timer.mark('line graph', nodes=G.numberOfNodes(), edges=len(G._src))
+        print 'Finished building basic lookups and line graph: ', secs, ' secs ', len(G._src), ' edges so far...'
+
+        attix, reader = feed.table('stops.txt')
         #print attix
         stopdata = {}
         for row in reader:
             stopdata[row[attix['stop_id']]] = [row[attix['stop_name']], float(row[attix['stop_lat']]), float(row[attix['stop_lon']])]
-        fn.close()
-        
+
+        footpaths = {}
         if filesindir.intersection(['transfers.txt']):            
             #4) load transfer file between stops...
-            fn = open(dir+r'\transfers.txt', 'rb')
-            reader = csv.reader(fn, delimiter=',')
-            atts = reader.next()
-            attix = dict(zip(atts, range(len(atts))))
+            attix, reader = feed.table('transfers.txt')
+            xfertimeix = attix.get('min_transfer_time')
             #print attix
-            #walkedges = []
             #from_stop_id,to_stop_id,transfer_type
             for row in reader:
-                if stoptrips.has_key(row[attix['from_stop_id']]) and stoptrips.has_key(row[attix['to_stop_id']]):
-                    ostoptrips = stoptrips[row[attix['from_stop_id']]]
-                    dstoptrips = stoptrips[row[attix['to_stop_id']]]
-    ##                avghw = 24*60/len(dstoptrips)
-    ##                if avghw < 15:
-    ##                    lim = 2400
-    ##                else:
-    ##                    lim = 3600
-                    lim = 4800
-                    wlktim = computeGCD(stopdata[row[attix['from_stop_id']]][1],stopdata[row[attix['from_stop_id']]][2],stopdata[row[attix['to_stop_id']]][1],stopdata[row[attix['to_stop_id']]][2])*1200*1.25
+                #a transfer from a stop to itself only repeats (a subset of) the within stop transfers
+                if stoptrips.has_key(row[attix['from_stop_id']]) and stoptrips.has_key(row[attix['to_stop_id']]) and row[attix['from_stop_id']] <> row[attix['to_stop_id']]:
+                    if xfertimeix is not None and row[xfertimeix] <> '':
+                        wlktim = float(row[xfertimeix]) #--> walk time already computed (e.g. by createTransferFile)
+                    else:
+                        wlktim = computeGCD(stopdata[row[attix['from_stop_id']]][1],stopdata[row[attix['from_stop_id']]][2],stopdata[row[attix['to_stop_id']]][1],stopdata[row[attix['to_stop_id']]][2])*1200*1.25
         ##            wlkdis = wlktim/1200
-                    for ostp, oarr, odep in ostoptrips:
-                        for dstp, darr, ddep in dstoptrips:
-                            #trip_id, arr, dep
-                            if oarr+wlktim < ddep and validtrips[ostp] <> validtrips[dstp]:
-                                conntime = max(60, ddep - oarr)
-                                if conntime < lim:
-                                    #validxfers[ostp+key, dstp+key] = conntime
-                                    edges.append([ostp+'^'+row[attix['from_stop_id']], dstp+'^'+row[attix['to_stop_id']], conntime+xferpen])
-                                    #walkedges.append([ostp+'^'+row[attix['from_stop_id']], dstp+'^'+row[attix['to_stop_id']], wlktim])
-        print 'Finished generating complete search graph in ', time.time()-t0, ' secs'
-        G = nx.DiGraph()
-        G.add_weighted_edges_from(edges, 'time')
-        del edges
+                    for eng in engines:
+                        eng.addFootpath(row[attix['from_stop_id']], row[attix['to_stop_id']], wlktim)
+                    footpaths.setdefault(row[attix['from_stop_id']], []).append((row[attix['to_stop_id']], wlktim))
+
+        stoptables = {}
+        stopchains = {}
+        xfercnt = [0, 0, 0] #transfer edges added, transfer edges without pruning, waiting chain edges
+        stops = stoptrips.keys()
+        for key in stops:
+            stoptables[key] = getStopTable(G, key, validtrips)
+            stopchains[key], cnt = getWaitChains(G, key, validtrips, tripdir)  #--> wait nodes added in stop order
+            xfercnt[2] += cnt
+        #all edges leaving an event come from its own stop, so sharding by stop keeps the edge order of every node
+        if processes > 1 and len(stops) > 1 and hasattr(os, 'fork'):
+            import multiprocessing
+            global _buildstate
+            _buildstate = (G, stoptables, stopchains, footpaths, xferpen)   #--> inherited by the forked workers
+            pool = multiprocessing.Pool(processes)
+            step = len(stops) // (processes*8) + 1
+            for edges, cnt in pool.imap(_transferEdges, [stops[i:i+step] for i in xrange(0, len(stops), step)]):
+                G.putEdges(*edges)
+                xfercnt[0] += cnt[0]
+                xfercnt[1] += cnt[1]
+            pool.close()
+            pool.join()
+            _buildstate = None
+        else:
+            for key in stops:
+                cnt = addStopTransfers(G, key, stoptables, stopchains, footpaths, xferpen)
+                xfercnt[0] += cnt[0]
+                xfercnt[1] += cnt[1]
+
+        secs = timer.mark('transfers', stops=len(stops), footpaths=sum(len(paths) for paths in footpaths.itervalues()),
+                          edges=len(G._src), transferedges=xfercnt[0], unprunededges=xfercnt[1], chainedges=xfercnt[2])
+        print 'Finished building transfers within and between stops: ', secs, ' secs', len(G._src), ' edges so far...'
+        G.indexFootpaths(footpaths)     #--> kept for trip updates
+        del stoptables, stopchains, footpaths
+        if calmethod == 0:
+            G.setServices(tripservices)
+            for eng in engines:
+                eng.setServices(tripservices, G.services)
+            del tripservices
+        if prune:
+            print 'Pruned transfer edges: kept ', xfercnt[0], ' of ', xfercnt[1], ' (', xfercnt[1]-xfercnt[0], ' pruned) plus ', xfercnt[2], ' waiting chain edges'
+        G.finalize(processes)
+        timer.mark('csr packing', nodes=G.numberOfNodes(), edges=G.numberOfEdges())
+        for eng in engines:
+            eng.finalize()
+            print 'Finished query engine: ', eng
+        if engines:
+            timer.mark('query engines')
+        G.buildstats = timer.phases()
+        print 'Finished generating complete search graph in ', timer.total(), ' secs ', G.numberOfNodes(), ' nodes ', G.numberOfEdges(), ' edges'
+        feed.close()
         return G, validservices, validtrips, stoptrips, getstopid, stopdata
     else:
+        feed.close()
         print 'The set of required files for generating the search graph is not complete. Processing aborted!'   #--->if this happens abort..
         return 0
 
+def LoadSearchGraph(dir, xferpen, calmethod, date='', day='', snapshot=None, engines=(), **options):
+    '''same as BuildSearchGraph but reuses a graph snapshot if one exists for the same feed files and parameters
+       snapshot = snapshot directory (None--> always build), a new snapshot is written there after a build
+       engines = query engines to fill as in BuildSearchGraph (stored in the snapshot as well)
+       options = passed on to BuildSearchGraph (e.g. prune=True)
+    '''
+    if snapshot is not None:
+        keyoptions = dict((k, v) for k, v in options.iteritems() if k <> 'processes')  #--> same graph for any processes
+        if engines:
+            keyoptions['engines'] = [eng.__class__.__name__ for eng in engines]
+        key = feedKey(dir, xferpen, calmethod, date, day, **keyoptions)
+        timer = PhaseTimer()
+        result = loadSnapshot(snapshot, key, engines)
+        if result is not None:
+            graph = result[0]
+            timer.mark('snapshot load', nodes=graph.numberOfNodes(), edges=graph.numberOfEdges())
+            graph.buildstats = timer.phases()
+            return result
+    result = BuildSearchGraph(dir, xferpen, calmethod, date, day, engines=engines, **options)
+    if result and snapshot is not None:
+        timer = PhaseTimer()
+        saveSnapshot(snapshot, key, *result, engines=engines)
+        timer.mark('snapshot save')
+        result[0].buildstats.extend(timer.phases())
+    return result
+
 #dirloc = r"C:\DevResearch\GTFS Builder\gtfs_trimet"
 dirloc = r"C:\DevResearch\GTFS Builder\gtfs_puget_sound_consolidated"
 xferpen = 650
-calmethod = 3
+calmethod = 3   #--> 0 builds one graph for the whole feed period, queries then pass the date
 date = '20151113' #'20150611'
 day = 'friday'
+snapshotloc = dirloc + '_graph'  #--> graph snapshot directory, set to None to always rebuild
+servermode = 'fork'     #--> 'fork' (worker processes sharing the graph, not on Windows) or 'thread'
+workers = 4             #--> number of worker processes/threads answering requests
+reqtimeout = 300        #--> request timeout in secs
+buildprocs = 1          #--> worker processes for building the graph (1--> build in this process)
+matrixprocs = 4         #--> worker processes per server worker for GetTravelTimeMatrix (1--> search in the server worker)
+matrixchunk = 16        #--> origins per matrix work unit
+matrixpool = None
+matrixpoolversion = None
+engine = 'graph'        #--> 'graph' (search graph), 'csa' (connection scan, earliest arrival at the destination stop) or
+                        #    'raptor' (fewest transfers vs arrival, transfer penalty chosen per query)
+maxrounds = 5           #--> max trips per journey for the raptor engine
+accessdist = 0.5        #--> max walking distance (miles) to/from stops for GetRouteFromPoints
+tripupdatesloc = None   #--> trip updates file (see tripUpdates), every server worker patches its graph when the file
+                        #    changes, None--> timetable only (the csa/raptor engines always use the timetable)
+tripupdatestime = None
+graphlock = ReadWriteLock() #--> requests read the graph, a trip update patches it once the running requests are done
+                            #    ('thread' mode, forked workers patch their own copy)
+cachebytes = 64 << 20   #--> memory limit of the query cache (GetRouteTime/GetRouteDetail paths and origin trees), 0--> off
+cachetrees = 256        #--> max origin search trees kept in the query cache
+querycache = None
+
+def getServiceMask(date):
+    #active services for a query date on a graph covering the whole feed period (calmethod 0), None otherwise
+    #such a graph mixes the trips of every day, so a query without a date would mix them as well
+    if not len(G.nodeservice):
+        return None
+    if not date:
+        raise ValueError('The graph covers the whole feed period, queries need a date (YYYYMMDD)')
+    if not servicemasks.has_key(date):
+        if len(servicemasks) > 64:
+            servicemasks.clear()
+        servicemasks[date] = G.serviceMask(calendar.services(date))
+    return servicemasks[date]
 
-beg = time.time()
-print 'Building search graph...'
-global G, validservices, validtrips, stoptrips, getstopid, stopdata #= BuildSearchGraph(dirloc, xferpen, calmethod, date, day)
-G, validservices, validtrips, stoptrips, getstopid, stopdata = BuildSearchGraph(dirloc, xferpen, calmethod, date, day)
-print 'Finished building search graph in: ', time.time()-beg, ' secs'
+def eventPath(o, d, date=''):
+    #graph search from event o to event d, returns the event nodes of the path (virtual nodes left out)
+    #repeated queries and destinations already settled from the same origin come from the query cache
+    mask = getServiceMask(date)
+    if querycache is None:
+        path = G.shortestPath(o, d, mask)[1]
+    else:
+        path = querycache.shortestPath(G, o, d, mask, date if mask is not None else '')[1]
+    return [node for node in path if G.nodetrip[node] >= 0]
 
-def GetRouteDetail(o, d): #, validtrips, getstopid):
-    path = nx.dijkstra_path(G,o,d, weight='time')
+def GetRouteDetail(o, d, date=''): #, validtrips, getstopid):
+    path = eventPath(o, d, date)
     #print path
-    tmp = path[0].split('^')
-    print 'Start by taking route: ', validtrips[tmp[0]], ' from: ', getstopid[path[0]][0] ,' at: ', getstopid[path[0]][2]
-    #resultstr = str(['Start by taking route: ', validtrips[tmp[0]], ' from: ', getstopid[path[0]][0] ,' at: ', getstopid[path[0]][2]])
-    deptimeinput = map(int, getstopid[path[0]][2].split(':'))
-    start = deptimeinput[0]*3600 + deptimeinput[1]*60 + deptimeinput[2]
-    currentRoute = validtrips[tmp[0]]
+    routes = [validtrips[G.trips.names[G.nodetrip[node]]] for node in path]
+    stopnames = G.stops.names
+    print 'Start by taking route: ', routes[0], ' from: ', stopnames[G.nodestop[path[0]]] ,' at: ', formatTime(G.nodedep[path[0]])
+    start = G.nodedep[path[0]]
+    currentRoute = routes[0]
     for i in xrange(1, len(path)-1):
-        tmp = path[i].split('^')
-        if validtrips[tmp[0]] <> currentRoute:
-            print 'Transfer at: ', getstopid[path[i]][0], ' to route: ', validtrips[tmp[0]],' at: ', getstopid[path[i]][2]
-            #'Transfer at: ', getstopid[path[i]][0], ' to route: ', validtrips[tmp[0]],' at: ', getstopid[path[i]][2]
-            currentRoute = validtrips[tmp[0]]
+        if routes[i] <> currentRoute:
+            print 'Transfer at: ', stopnames[G.nodestop[path[i]]], ' to route: ', routes[i],' at: ', formatTime(G.nodedep[path[i]])
+            currentRoute = routes[i]
             
-    tmp = path[-1].split('^')
-    print 'End at destination: ', getstopid[path[-1]][0], ' on route: ', validtrips[tmp[0]] ,'at: ', getstopid[path[-1]][1]
-    #resultstr+= str('End at destination: ', getstopid[path[-1]][0], ' on route: ', validtrips[tmp[0]] ,'at: ', getstopid[path[-1]][1])
-    deptimeinput = map(int, getstopid[path[-1]][1].split(':'))
-    end = deptimeinput[0]*3600 + deptimeinput[1]*60 + deptimeinput[2]
+    print 'End at destination: ', stopnames[G.nodestop[path[-1]]], ' on route: ', routes[-1] ,'at: ', formatTime(G.nodearr[path[-1]])
+    end = G.nodearr[path[-1]]
     
     print 'Travel time: ', (end - start)/60.0, ' mins'
     #resultstr+=str('Travel time: ', (end - start)/60.0, ' mins')
     #return resultstr
 
 
-def GetRouteTime(o, d, validtrips, getstopid):
-    path = nx.dijkstra_path(G,o,d, weight='time')
+def GetRouteTime(o, d, validtrips=None, getstopid=None, date='', xferpen=None):
+    #validtrips/getstopid = ignored, kept so old clients sending their own lookups (with 'HH:MM:SS' times) still
+    #work, the event times come from the graph
+    #xferpen = transfer penalty of this query (raptor engine only, the graph has it built in), None--> build xferpen
+    if xferpen is None:
+        xferpen = globals()['xferpen']
+    if engine in ('raptor', 'csa'):
+        onode, dnode = G.nodeId(o), G.nodeId(d)
+        ostop, dstop = G.stops.names[G.nodestop[onode]], G.stops.names[G.nodestop[dnode]]
+        deptm = G.nodedep[onode]
+    if engine == 'raptor':
+        journey = bestJourney(raptor.query(ostop, dstop, deptm, maxrounds, getServiceMask(date)), xferpen)
+        if journey is None:
+            raise NoPath('No path between %s and %s' % (o, d))
+        return journey[0] - deptm
+    if engine == 'csa':
+        #--> earliest arrival at the stop of d leaving the stop of o at the departure of o (on any trip)
+        arrival = connections.earliestArrival(ostop, dstop, deptm, getServiceMask(date))[0]
+        if arrival is None:
+            raise NoPath('No path between %s and %s' % (o, d))
+        return arrival - deptm
+    path = eventPath(o, d, date)
     #print path
-    tmp = path[0].split('^')
-    deptimeinput = map(int, getstopid[path[0]][2].split(':'))
-    start = deptimeinput[0]*3600 + deptimeinput[1]*60 + deptimeinput[2]
-
-    deptimeinput = map(int, getstopid[path[-1]][1].split(':'))
-    end = deptimeinput[0]*3600 + deptimeinput[1]*60 + deptimeinput[2]
-    ttime = end - start
+    ttime = G.nodearr[path[-1]] - G.nodedep[path[0]]
     #print 'Travel time: ', ttime, ' secs'
     return ttime
 
-def Quit():
-    global flag
-    flag = 1
-    return flag
+def GetSearchStats(o, d, date=''):
+    '''o, d = trip_id^stop_id events as in GetRouteTime
+       returns dict with the path cost, the number of nodes settled by dijkstra on the search graph and its secs
+    '''
+    onode, dnode = G.nodeId(o), G.nodeId(d)
+    mask = getServiceMask(date)
+    ts = time.time()
+    dist, pred, reached = G.dijkstra(onode, dnode, active=mask)
+    dtime = time.time() - ts
+    if reached is None:
+        raise NoPath('No path between %s and %s' % (o, d))
+    return {'cost': dist[dnode], 'dijkstra_settled': len(dist), 'dijkstra_secs': dtime}
 
-#server.register_function(BuildSearchGraph, 'BuildSearchGraph')
-server.register_function(GetRouteDetail, 'GetRouteDetail')
-server.register_function(GetRouteTime, 'GetRouteTime')
-server.register_function(Quit, 'Quit')
+def GetCacheStats():
+    #query cache counters of the worker answering the call (forked workers each have their own cache)
+    if querycache is None:
+        return {}
+    return querycache.stats()
+
+def Stats():
+    '''counters of the worker answering the call (forked workers each count their own queries):
+       build = phases of the graph build or snapshot load (secs, peak memory in MB, edge counts etc.)
+       queries = calls, errors and latency percentiles in ms per method
+       cache = query cache counters (see GetCacheStats)
+    '''
+    peak, childpeak = peakMemory()
+    return {'pid': os.getpid(), 'nodes': G.numberOfNodes(), 'edges': G.numberOfEdges(), 'version': G.version,
+            'patched_rows': len(G.patched), 'peak_mb': peak, 'build_children_peak_mb': childpeak,
+            'build': G.buildstats, 'queries': server.querystats.report(), 'cache': GetCacheStats()}
+
+def _matrixRows(args):
+    #one to many searches for a chunk of origins, run in the matrix pool (or in this process)
+    onodes, deptimes, dnodes, arrtimes, mask = args
+    targets = set(node for node in dnodes if node >= 0)
+    rows = []
+    for onode, deptm in zip(onodes, deptimes):
+        if onode < 0:
+            rows.append([-1]*len(dnodes))
+            continue
+        dist = G.dijkstra(onode, targets=targets, active=mask)[0]
+        rows.append([arrtm - deptm if dist.has_key(dnode) else -1 for dnode, arrtm in zip(dnodes, arrtimes)])
+    return rows
+
+def GetTravelTimeMatrix(origins, destinations, date=''):
+    '''origins, destinations = lists of trip_id^stop_id events as in GetRouteTime
+       date = query date YYYYMMDD (required on graphs covering the whole feed period, ignored otherwise)
+       returns the travel time matrix in secs (same as GetRouteTime) as one list per origin, -1 where there is no path
+       Each origin is one search that stops once all destinations are reached, origins are spread over matrixprocs
+       worker processes.
+    '''
+    mask = getServiceMask(date)
+    def lookup(name, times):
+        try:
+            node = G.nodeId(name)
+        except (KeyError, ValueError):
+            return -1, 0
+        return node, times[node]
+    onodes, deptimes = zip(*[lookup(o, G.nodedep) for o in origins]) if origins else ((), ())
+    dnodes, arrtimes = zip(*[lookup(d, G.nodearr) for d in destinations]) if destinations else ((), ())
+    chunks = [(onodes[i:i+matrixchunk], deptimes[i:i+matrixchunk], dnodes, arrtimes, mask)
+              for i in xrange(0, len(onodes), matrixchunk)]
+    return [row for rows in poolMap(_matrixRows, chunks) for row in rows]
 
-flag = 0
-while flag <> 1:
-    server.handle_request()
+def poolMap(func, chunks):
+    #runs func over the work units in the matrix pool (matrixprocs processes) or in this process
+    global matrixpool, matrixpoolversion
+    if matrixprocs > 1 and len(chunks) > 1 and hasattr(os, 'fork'):
+        if matrixpool is not None and matrixpoolversion <> G.version:
+            matrixpool.terminate()  #--> forked before the last trip update, fork again
+            matrixpool = None
+        if matrixpool is None:
+            import multiprocessing
+            matrixpool = multiprocessing.Pool(matrixprocs)   #--> forked after the graph is loaded, workers share it
+            matrixpoolversion = G.version
+        return matrixpool.map(func, chunks)
+    return map(func, chunks)
+
+def getAccessSources(cands, depart_after):
+    '''cands = dict stop_id -> [walk secs, lat/lon] (StopIndex.candidates)
+       depart_after = departure time in secs
+       returns sources (event node -> secs from depart_after to its departure) for all events leaving the candidate
+       stops after depart_after plus the walk, and access (event node -> walk secs)
+    '''
+    sources = {}
+    access = {}
+    stopevents, stopdeps = G.stopevents, G.stopdeps
+    for stop_id, (walk, latlon) in cands.iteritems():
+        lo, hi = G.stopRange(stop_id)
+        for p in xrange(bisect_left(stopdeps, depart_after + int(ceil(walk)), lo, hi), hi):
+            node, dep = stopevents[p], stopdeps[p]
+            if not sources.has_key(node) or dep - depart_after < sources[node]:
+                sources[node] = dep - depart_after
+                access[node] = int(ceil(walk))
+    return sources, access
+
+def GetRouteFromPoints(orig_latlon, dest_latlon, depart_after, date='', maxDist=None):
+    '''orig_latlon, dest_latlon = origin and destination [lat, lon]
+       depart_after = earliest departure from the origin, 'HH:MM:SS' or secs since midnight
+       date = query date YYYYMMDD (required on graphs covering the whole feed period, ignored otherwise)
+       maxDist = max walking distance (miles) to and from stops, None--> accessdist
+       Every event at a candidate origin stop that departs after depart_after plus the walk is a source (cost = time
+       since depart_after) and every event at a candidate destination stop a sink (extra cost = walk from the stop),
+       a single search then finds the best itinerary. A stop that is both an origin and a destination candidate is a
+       walk via the stop (access + egress walk), never a ride-less itinerary waiting at the stop.
+       returns dict with travel_time (secs), arrival (HH:MM:SS), access/egress stop and walk secs and the path of
+       trip_id^stop_id events (empty if walking all the way is faster), raises NoPath if there is no itinerary
+    '''
+    if maxDist is None:
+        maxDist = accessdist
+    if not isinstance(depart_after, (int, long)):
+        depart_after = parseTime(depart_after)
+    ocands, dcands = stopindex.candidateStops(orig_latlon, dest_latlon, maxDist)
+    sources, access = getAccessSources(ocands, depart_after)
+    sinks = {}
+    for stop_id, (walk, latlon) in dcands.iteritems():
+        lo, hi = G.stopRange(stop_id)
+        for p in xrange(lo, hi):
+            sinks[G.stopevents[p]] = int(ceil(walk))
+    result = None
+    if sources and sinks:
+        dist, pred, reached = G.dijkstra(sources, sinks, active=getServiceMask(date))
+        if reached is not None:
+            path = [node for node in G.path(pred, reached) if G.nodetrip[node] >= 0]
+            arrival = G.nodearr[path[-1]] + sinks[reached]
+            result = {'travel_time': arrival - depart_after, 'arrival': formatTime(arrival),
+                      'access_stop': G.stops.names[G.nodestop[path[0]]], 'access_walk': access[path[0]],
+                      'egress_stop': G.stops.names[G.nodestop[path[-1]]], 'egress_walk': sinks[reached],
+                      'path': [G.nodeName(node) for node in path]}
+    for stop_id in set(ocands).intersection(dcands):
+        owalk, dwalk = int(ceil(ocands[stop_id][0])), int(ceil(dcands[stop_id][0]))
+        if result is None or owalk + dwalk < result['travel_time']:
+            result = {'travel_time': owalk + dwalk, 'arrival': formatTime(depart_after + owalk + dwalk),
+                      'access_stop': stop_id, 'access_walk': owalk, 'egress_stop': stop_id, 'egress_walk': dwalk,
+                      'path': []}
+    direct = computeGCD(orig_latlon[0], orig_latlon[1], dest_latlon[0], dest_latlon[1])
+    if direct < maxDist and (result is None or direct*3600/3.0 < result['travel_time']):
+        walk = int(ceil(direct*3600/3.0))
+        result = {'travel_time': walk, 'arrival': formatTime(depart_after + walk), 'access_stop': '',
+                  'access_walk': walk, 'egress_stop': '', 'egress_walk': 0, 'path': []}
+    if result is None:
+        raise NoPath('No itinerary between %s and %s after %s' % (orig_latlon, dest_latlon, formatTime(depart_after)))
+    return result
+
+def reachableStops(origin, depart_after, budget, mask=None):
+    '''origin = stop_id or [lat, lon] (stops within accessdist are walked to)
+       depart_after, budget = departure and time budget in secs
+       returns dict stop_id -> earliest arrival secs for the stops reached within the budget
+    '''
+    if isinstance(origin, (list, tuple)):
+        cands = stopindex.candidates(origin, accessdist)
+    else:
+        cands = {origin: [0, None]}
+    reached = {}
+    for stop_id, (walk, latlon) in cands.iteritems():
+        if walk <= budget:
+            reached[stop_id] = depart_after + int(ceil(walk))
+    sources = getAccessSources(cands, depart_after)[0]
+    if not sources:
+        return reached
+    #--> bounded by clock time, not by cost: transfers cost at least 60 secs, so an event reached in time can cost
+    #    more than the budget
+    limit = depart_after + budget
+    dist, pred = G.dijkstra(sources, active=mask, xferpen=xferpen, until=limit)[:2]
+    nodetrip, nodestop, nodearr = G.nodetrip, G.nodestop, G.nodearr
+    best = {}       #--> stop index -> earliest arrival
+    for node in dist:
+        #--> only events reached on their own trip are arrivals, events reached over a transfer edge (or sources) are
+        #    boarded at their departure
+        if nodetrip[node] < 0 or not pred.has_key(node) or nodetrip[pred[node]] <> nodetrip[node]:
+            continue
+        arr = nodearr[node]
+        if 0 <= arr <= limit and arr < best.get(nodestop[node], limit+1):
+            best[nodestop[node]] = arr
+    stopnames = G.stops.names
+    for six, arr in best.iteritems():
+        if arr < reached.get(stopnames[six], limit+1):
+            reached[stopnames[six]] = arr
+    #one walk (transfers.txt footpath) after each trip or from the access stops, as in the search graph
+    for stop_id, arr in reached.items():
+        for to_stop, walk in G.footpathsFrom(stop_id):
+            walkarr = arr + int(ceil(walk))
+            if walkarr <= limit and walkarr < reached.get(to_stop, limit+1):
+                reached[to_stop] = walkarr
+    return reached
+
+def GetReachableStops(origin, depart_after, budget_secs, date=''):
+    '''origin = stop_id or [lat, lon] (stops within accessdist are walked to)
+       depart_after = departure, 'HH:MM:SS' or secs since midnight
+       budget_secs = time budget in secs
+       date = query date YYYYMMDD (required on graphs covering the whole feed period, ignored otherwise)
+       one search bounded by the budget, returns dict stop_id -> [earliest arrival HH:MM:SS, secs after depart_after]
+    '''
+    if not isinstance(depart_after, (int, long)):
+        depart_after = parseTime(depart_after)
+    reached = reachableStops(origin, depart_after, budget_secs, getServiceMask(date))
+    return dict((stop_id, [formatTime(arr), arr - depart_after]) for stop_id, arr in reached.iteritems())
+
+def _reachableChunk(args):
+    #reachableStops for a chunk of origins, run in the matrix pool (or in this process)
+    origins, depart_after, budget, date = args
+    mask = getServiceMask(date)
+    return [dict((stop_id, arr - depart_after) for stop_id, arr in reachableStops(origin, depart_after, budget, mask).iteritems())
+            for origin in origins]
+
+def GetReachableStopsBatch(origins, depart_after, budget_secs, date=''):
+    '''origins = list of stop_ids or [lat, lon] points
+       depart_after, budget_secs, date = as GetReachableStops
+       returns one dict stop_id -> secs after depart_after per origin, origins are spread over matrixprocs processes
+    '''
+    if not isinstance(depart_after, (int, long)):
+        depart_after = parseTime(depart_after)
+    chunks = [(origins[i:i+matrixchunk], depart_after, budget_secs, date) for i in xrange(0, len(origins), matrixchunk)]
+    return [reached for rows in poolMap(_reachableChunk, chunks) for reached in rows]
+
+def ApplyTripUpdates(path):
+    '''path = trip updates file (see tripUpdates), the full set of updates in effect
+       patches the search graph of this process in place (milliseconds for a few trips), returns the patchTripUpdates
+       summary
+    '''
+    result = patchTripUpdates(G, tripUpdates(path), validtrips, xferpen)
+    print 'Applied trip updates from ', path, ': ', result
+    return result
+
+def checkTripUpdates():
+    #run before every request (QueryServer refresh), applies tripupdatesloc again if it changed since, holding
+    #graphlock for writing so no other thread searches the graph while its arrays change
+    global tripupdatestime
+    if tripupdatesloc is None:
+        return
+    try:
+        mtime = os.stat(tripupdatesloc).st_mtime
+    except OSError:
+        return
+    if mtime <> tripupdatestime:
+        with graphlock.writing():
+            if mtime <> tripupdatestime:
+                ApplyTripUpdates(tripupdatesloc)
+                tripupdatestime = mtime
+
+def GetEarliestArrival(o_stop, d_stop, depart_after, date=''):
+    '''o_stop, d_stop = origin and destination stop_ids
+       depart_after = earliest departure, 'HH:MM:SS' or secs since midnight
+       date = query date YYYYMMDD (required on graphs covering the whole feed period, ignored otherwise)
+       returns dict with travel_time (secs), arrival (HH:MM:SS) and the legs [trip_id ('' for walks), from stop,
+       departure, to stop, arrival] from the connection scan engine, raises NoPath if d_stop cannot be reached
+    '''
+    if not isinstance(depart_after, (int, long)):
+        depart_after = parseTime(depart_after)
+    arrival, legs = connections.earliestArrival(o_stop, d_stop, depart_after, getServiceMask(date))
+    if arrival is None:
+        raise NoPath('No path between %s and %s after %s' % (o_stop, d_stop, formatTime(depart_after)))
+    return {'travel_time': arrival - depart_after, 'arrival': formatTime(arrival), 'legs': formatLegs(legs)}
+
+def formatLegs(legs):
+    #engine legs -> [trip_id ('' for walks), from stop, departure, to stop, arrival] with HH:MM:SS times
+    return [[trip_id or '', ostop, formatTime(dep), dstop, formatTime(arr)] for trip_id, ostop, dep, dstop, arr in legs]
+
+def GetProfile(o_stop, d_stop, window_start, window_end, date=''):
+    '''o_stop, d_stop = origin and destination stop_ids
+       window_start, window_end = departure window, 'HH:MM:SS' or secs since midnight
+       date = query date YYYYMMDD (required on graphs covering the whole feed period, ignored otherwise)
+       returns the Pareto optimal journeys of the window as [departure, arrival, travel time secs] in departure order
+    '''
+    if not isinstance(window_start, (int, long)):
+        window_start = parseTime(window_start)
+    if not isinstance(window_end, (int, long)):
+        window_end = parseTime(window_end)
+    return [[formatTime(dep), formatTime(arr), arr - dep]
+            for dep, arr in connections.profile(o_stop, d_stop, window_start, window_end, getServiceMask(date))]
+
+def GetParetoRoutes(o_stop, d_stop, depart_after, date='', rounds=None, xferpen=None):
+    '''o_stop, d_stop = origin and destination stop_ids
+       depart_after = earliest departure, 'HH:MM:SS' or secs since midnight
+       date = query date YYYYMMDD (required on graphs covering the whole feed period, ignored otherwise)
+       rounds = max trips per journey, None--> maxrounds
+       xferpen = transfer penalty in secs used to pick the best journey, None--> build xferpen
+       returns the Pareto set of journeys from the raptor engine (fewest transfers first) as dicts with travel_time
+       (secs), arrival (HH:MM:SS), transfers, best (1 for the lowest travel time + xferpen * transfers) and legs
+    '''
+    if not isinstance(depart_after, (int, long)):
+        depart_after = parseTime(depart_after)
+    if xferpen is None:
+        xferpen = globals()['xferpen']
+    journeys = raptor.query(o_stop, d_stop, depart_after, rounds or maxrounds, getServiceMask(date))
+    best = bestJourney(journeys, xferpen)
+    return [{'travel_time': arrival - depart_after, 'arrival': formatTime(arrival), 'transfers': transfers,
+             'best': int(best[0] == arrival), 'legs': formatLegs(legs)} for arrival, transfers, legs in journeys]
 
+if __name__ == '__main__':
+    beg = time.time()
+    print 'Building search graph...'
+    global G, validservices, validtrips, stoptrips, getstopid, stopdata, stopindex #= BuildSearchGraph(dirloc, xferpen, calmethod, date, day)
+    global connections, raptor
+    connections = ConnectionScan() if engine == 'csa' else None
+    raptor = Raptor() if engine == 'raptor' else None
+    engines = [eng for eng in (connections, raptor) if eng is not None]
+    G, validservices, validtrips, stoptrips, getstopid, stopdata = LoadSearchGraph(dirloc, xferpen, calmethod, date, day, snapshotloc, engines, processes=buildprocs)
+    stopindex = StopIndex(stopdata)
+    global calendar, servicemasks
+    calendar = ServiceCalendar(GTFSFeed(dirloc)) if calmethod == 0 else None
+    servicemasks = {}
+    querycache = QueryCache(cachebytes, cachetrees) if cachebytes else None
+    if tripupdatesloc is not None:
+        G.patchIndex()          #--> shared by the workers as well
+        checkTripUpdates()
+    print 'Finished building search graph in: ', time.time()-beg, ' secs'
 
+    server = QueryServer(("localhost", 8000), workers, servermode, reqtimeout, refresh=checkTripUpdates, lock=graphlock)
+    #server.register_function(BuildSearchGraph, 'BuildSearchGraph')
+    server.register_function(GetRouteDetail, 'GetRouteDetail')
+    server.register_function(GetRouteTime, 'GetRouteTime')
+    server.register_function(GetTravelTimeMatrix, 'GetTravelTimeMatrix')
+    server.register_function(GetRouteFromPoints, 'GetRouteFromPoints')
+    server.register_function(GetSearchStats, 'GetSearchStats')
+    server.register_function(GetCacheStats, 'GetCacheStats')
+    server.register_function(Stats, 'Stats')
+    server.register_function(GetReachableStops, 'GetReachableStops')
+    server.register_function(GetReachableStopsBatch, 'GetReachableStopsBatch')
+    if connections is not None:
+        server.register_function(GetEarliestArrival, 'GetEarliestArrival')
+        server.register_function(GetProfile, 'GetProfile')
+    if raptor is not None:
+        server.register_function(GetParetoRoutes, 'GetParetoRoutes')
+    server.serve()  #--> until the Quit call (registered by QueryServer) or SIGTERM/Ctrl-C
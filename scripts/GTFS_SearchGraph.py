@@ -0,0 +1,590 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS search graph (compact graph backend for the route server)
+# Purpose:     Stores the time expanded search graph as integer indexed CSR arrays (offsets, targets, weights) with
+#              trip and stop IDs interned to integers, and runs Dijkstra directly on those arrays. Event times and the
+#              events of every stop in departure order are integer columns as well (stoptrips/getstopid are views
+#              over them). Trip updates (delays, cancellations) patch single rows through an overlay of replaced
+#              out edges, the CSR arrays stay as built (or mapped). NetworkX is only needed if the graph is exported
+#              with toNetworkX().
+#
+# Dependencies: standard python modules only, networkx is optional (export only)
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import os
+from array import array
+from heapq import heappush, heappop
+
+
+class NoPath(Exception):
+    '''raised when the target cannot be reached from the source'''
+    pass
+
+
+class IDTable(object):
+    '''interns string IDs (trip_id, stop_id etc.) to consecutive integers'''
+    def __init__(self, names=None):
+        self.names = []
+        self.index = {}
+        if names is not None:
+            for name in names:
+                self.intern(name)
+
+    def intern(self, name):
+        ix = self.index.get(name)
+        if ix is None:
+            ix = len(self.names)
+            self.index[name] = ix
+            self.names.append(name)
+        return ix
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return self.index[name]
+
+    def get(self, name, default=None):
+        return self.index.get(name, default)
+
+
+def _packEdges(src, dst, wt, lo, hi, edges=None):
+    #CSR arrays (offsets from 0, targets, weights) of the out edges of nodes lo:hi, a node keeps the order its edges
+    #were added in
+    #edges = indices of the edges leaving lo:hi in the order added (see _splitEdges), None--> picked from all edges
+    n = hi - lo
+    if edges is not None:
+        pass
+    elif lo == 0 and (not len(src) or max(src) < hi):
+        edges = xrange(len(src))    #--> all nodes, no need to pick the edges
+    else:
+        edges = [i for i in xrange(len(src)) if lo <= src[i] < hi]
+    counts = array('l', [0])*(n+1)
+    for i in edges:
+        counts[src[i]-lo+1] += 1
+    for i in xrange(n):
+        counts[i+1] += counts[i]
+    pos = array('l', counts)
+    targets = array('i', [0])*len(edges)
+    weights = array('i', [0])*len(edges)
+    for i in edges:
+        u = src[i]-lo
+        p = pos[u]
+        targets[p] = dst[i]
+        weights[p] = wt[i]
+        pos[u] = p+1
+    #parallel edges (e.g. a transfers.txt row from a stop to itself) collapse to the cheapest one (nx.DiGraph kept the
+    #last weight added, which could hide a cheaper transfer)
+    k = 0
+    for u in xrange(n):
+        beg, end = counts[u], counts[u+1]
+        counts[u] = k
+        if end - beg > 1:
+            best = {}
+            for p in xrange(beg, end):
+                v = targets[p]
+                if v not in best or weights[p] < best[v]:
+                    best[v] = weights[p]
+            for p in xrange(beg, end):
+                v = targets[p]
+                if v in best:
+                    targets[k] = v
+                    weights[k] = best.pop(v)
+                    k += 1
+        else:
+            for p in xrange(beg, end):
+                targets[k] = targets[p]
+                weights[k] = weights[p]
+                k += 1
+    counts[n] = k
+    del targets[k:], weights[k:]
+    return counts, targets, weights
+
+def _splitEdges(src, step, shards):
+    #indices of the edges leaving every node range k*step:(k+1)*step in the order added, one pass over the edges
+    edges = [array('i') for k in xrange(shards)]
+    adds = [shard.append for shard in edges]
+    i = 0
+    for u in src:
+        adds[u // step](i)
+        i += 1
+    return edges
+
+_packing = None
+
+def _packShard(k):
+    #_packEdges for node range k in a forked finalize() worker, returned as raw array strings
+    src, dst, wt, ranges, edges = _packing
+    lo, hi = ranges[k]
+    return tuple(a.tostring() for a in _packEdges(src, dst, wt, lo, hi, edges[k]))
+
+
+class StopTrips(object):
+    '''stoptrips lookup over the graph columns: stop_id -> list of (trip_id, arrival secs, departure secs) in departure
+       order, keys are the stops with events (the query path uses G.stopRange() and the columns directly)
+    '''
+    def __init__(self, G):
+        self.G = G
+
+    def __getitem__(self, stop_id):
+        G = self.G
+        lo, hi = G.stopRange(stop_id)
+        if lo == hi:
+            raise KeyError(stop_id)
+        tripnames, nodetrip, stopevents = G.trips.names, G.nodetrip, G.stopevents
+        return [(tripnames[nodetrip[stopevents[p]]], G.stoparrs[p], G.stopdeps[p]) for p in xrange(lo, hi)]
+
+    def get(self, stop_id, default=None):
+        try:
+            return self[stop_id]
+        except KeyError:
+            return default
+
+    def has_key(self, stop_id):
+        lo, hi = self.G.stopRange(stop_id)
+        return lo < hi
+
+    __contains__ = has_key
+
+    def keys(self):
+        offsets, names = self.G.stopoffsets, self.G.stops.names
+        return [names[s] for s in xrange(len(offsets)-1) if offsets[s] < offsets[s+1]]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+
+class EventTimes(object):
+    '''getstopid lookup over the graph columns: 'trip_id^stop_id' (or event node) -> (stop_id, arrival secs, departure
+       secs), -1 for a time missing in stop_times.txt
+    '''
+    def __init__(self, G):
+        self.G = G
+
+    def __getitem__(self, name):
+        G = self.G
+        node = name if isinstance(name, (int, long)) else G.nodeId(name)
+        return G.stops.names[G.nodestop[node]], G.nodearr[node], G.nodedep[node]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except (KeyError, ValueError):
+            return default
+
+    def has_key(self, name):
+        return self.get(name) is not None
+
+    __contains__ = has_key
+
+
+class SearchGraph(object):
+    '''time expanded search graph: one node per trip_id^stop_id event, edges stored as CSR arrays
+       offsets[u]:offsets[u+1] = slice of targets/weights holding the out edges of node u
+       Edges are collected with addEdge() and packed into CSR form by finalize().
+    '''
+    def __init__(self):
+        self.trips = IDTable()
+        self.stops = IDTable()
+        self.nodetrip = array('i')  #node -> trip index (-1 for virtual nodes, e.g. waiting chains)
+        self.nodestop = array('i')  #node -> stop index
+        self.nodeindex = {}         #(trip index << 32 | stop index) -> node
+        self.nodearr = array('i')   #node -> arrival secs of the event (-1 for virtual nodes or no time)
+        self.nodedep = array('i')   #node -> departure secs of the event (-1 for virtual nodes or no time)
+        self.stopoffsets = array('l', [0])  #stop index -> slice of stopevents/stoparrs/stopdeps (see indexStops)
+        self.stopevents = array('i')
+        self.stoparrs = array('i')
+        self.stopdeps = array('i')
+        self.services = IDTable()   #service_id table (only for graphs covering the whole feed period)
+        self.nodeservice = array('i')  #node -> service index of its trip (-1 for virtual nodes), empty if not used
+        self.offsets = array('l', [0])
+        self.targets = array('i')
+        self.weights = array('i')
+        self._src = array('i')
+        self._dst = array('i')
+        self._wt = array('i')
+        self.footoffsets = array('l', [0])  #stop index -> slice of footstops/footwalks (see indexFootpaths)
+        self.footstops = array('i')
+        self.footwalks = array('d')
+        self.patched = {}           #node -> (targets, weights) replacing its CSR row (trip updates, see patchRows)
+        self.scheduled = {}         #node -> timetable (arrival, departure) of events moved by trip updates
+        self.tripupdates = {}       #trip_id -> trip update in effect (see patchTripUpdates in the route server)
+        self.version = 0            #bumped by every patch (e.g. to drop cached query results)
+        self.pruned = False         #transfer edges to the first departure per waiting chain only (see BuildSearchGraph)
+        self.buildstats = []        #phases of the build or snapshot load of this graph (see GTFS_Stats.PhaseTimer)
+        self._patchindex = None     #trip -> events, stop -> wait chains and stop -> footpaths into it (see patchIndex)
+
+    def addEvent(self, trip_id, stop_id, arrtm=None, deptm=None):
+        #returns the node for trip_id^stop_id, adding it if needed, arrtm/deptm = event times in secs (None if missing)
+        tix = self.trips.intern(trip_id)
+        six = self.stops.intern(stop_id)
+        key = tix << 32 | six
+        node = self.nodeindex.get(key)
+        if node is None:
+            node = len(self.nodetrip)
+            self.nodeindex[key] = node
+            self.nodetrip.append(tix)
+            self.nodestop.append(six)
+            self.nodearr.append(-1)
+            self.nodedep.append(-1)
+        if arrtm is not None:
+            self.nodearr[node] = arrtm
+        if deptm is not None:
+            self.nodedep[node] = deptm
+        return node
+
+    def addNode(self, stop_id):
+        #adds a virtual node at stop_id that is not a trip event (e.g. a wait node), returns the node
+        node = len(self.nodetrip)
+        self.nodetrip.append(-1)
+        self.nodestop.append(self.stops.intern(stop_id))
+        self.nodearr.append(-1)
+        self.nodedep.append(-1)
+        return node
+
+    def isEvent(self, node):
+        return self.nodetrip[node] >= 0
+
+    def event(self, trip_id, stop_id):
+        #node for trip_id^stop_id, raises KeyError if the event is not in the graph
+        return self.nodeindex[self.trips[trip_id] << 32 | self.stops[stop_id]]
+
+    def indexStops(self, nodes, arrs, deps):
+        '''nodes, arrs, deps = parallel arrays of the stop_times.txt rows with both times (event node, arrival secs,
+           departure secs) in file order
+           groups the rows by stop in departure order (stable) into stopevents/stoparrs/stopdeps, the rows of stop
+           index s are stopoffsets[s]:stopoffsets[s+1] (see stopRange)
+        '''
+        nodestop = self.nodestop
+        order = sorted(xrange(len(nodes)), key=lambda i: (nodestop[nodes[i]], deps[i]))
+        counts = array('l', [0])*(len(self.stops)+1)
+        for node in nodes:
+            counts[nodestop[node]+1] += 1
+        for i in xrange(len(self.stops)):
+            counts[i+1] += counts[i]
+        self.stopoffsets = counts
+        self.stopevents = array('i', [nodes[i] for i in order])
+        self.stoparrs = array('i', [arrs[i] for i in order])
+        self.stopdeps = array('i', [deps[i] for i in order])
+        return self
+
+    def stopRange(self, stop_id):
+        #stop_id -> (lo, hi) slice of stopevents/stoparrs/stopdeps, departures sorted so bisect(stopdeps, t, lo, hi) works
+        six = self.stops.get(stop_id)
+        if six is None or six+1 >= len(self.stopoffsets):
+            return 0, 0
+        return self.stopoffsets[six], self.stopoffsets[six+1]
+
+    def indexFootpaths(self, footpaths):
+        #footpaths = dict from stop_id -> list of (to stop_id, walk secs) in transfers.txt order, kept as CSR arrays
+        #so trip updates can find the transfers of a stop (see footpathsFrom)
+        offsets = array('l', [0])
+        stops = array('i')
+        walks = array('d')
+        for six in xrange(len(self.stops)):
+            for to_stop, walk in footpaths.get(self.stops.names[six], ()):
+                stops.append(self.stops[to_stop])
+                walks.append(walk)
+            offsets.append(len(stops))
+        self.footoffsets, self.footstops, self.footwalks = offsets, stops, walks
+        return self
+
+    def footpathsFrom(self, stop_id):
+        #stop_id -> list of (to stop_id, walk secs) as given to indexFootpaths
+        six = self.stops.get(stop_id)
+        if six is None or six+1 >= len(self.footoffsets):
+            return []
+        names = self.stops.names
+        return [(names[self.footstops[p]], self.footwalks[p]) for p in xrange(self.footoffsets[six], self.footoffsets[six+1])]
+
+    def addEdge(self, u, v, w):
+        self._src.append(u)
+        self._dst.append(v)
+        self._wt.append(w)
+
+    def takeEdges(self):
+        #returns the collected edges as raw (sources, targets, weights) array strings and clears them, e.g. to send the
+        #edges built in a worker process back with putEdges()
+        edges = self._src.tostring(), self._dst.tostring(), self._wt.tostring()
+        self.clearEdges()
+        return edges
+
+    def clearEdges(self):
+        #drops the collected edges, e.g. the ones a forked worker process inherited from its parent
+        self._src, self._dst, self._wt = array('i'), array('i'), array('i')
+
+    def putEdges(self, src, dst, wt):
+        #appends raw edge array strings from takeEdges()
+        self._src.fromstring(src)
+        self._dst.fromstring(dst)
+        self._wt.fromstring(wt)
+
+    def finalize(self, processes=1):
+        #packs the collected edges into CSR arrays (counting sort on the source node)
+        #processes > 1--> node ranges are packed by forked worker processes, the arrays are the same (the edges are
+        #split by node range here once, so every worker only looks at the edges of its range)
+        global _packing
+        n = len(self.nodetrip)
+        if processes > 1 and n > processes and hasattr(os, 'fork'):
+            import multiprocessing
+            step = n // processes + 1
+            ranges = [(lo, min(lo+step, n)) for lo in xrange(0, n, step)]
+            _packing = (self._src, self._dst, self._wt, ranges, _splitEdges(self._src, step, len(ranges)))
+            pool = multiprocessing.Pool(processes)   #--> the workers inherit _packing
+            shards = pool.map(_packShard, xrange(len(ranges)))
+            pool.close()
+            pool.join()
+            _packing = None
+            offsets, targets, weights = array('l', [0]), array('i'), array('i')
+            for offs, tgts, wts in shards:
+                base = offsets[-1]
+                shard = array('l')
+                shard.fromstring(offs)
+                offsets.extend(array('l', [base + k for k in shard[1:]]))
+                targets.fromstring(tgts)
+                weights.fromstring(wts)
+        else:
+            offsets, targets, weights = _packEdges(self._src, self._dst, self._wt, 0, n)
+        self.offsets, self.targets, self.weights = offsets, targets, weights
+        self._src, self._dst, self._wt = array('i'), array('i'), array('i')
+        return self
+
+    def setServices(self, tripservices):
+        #tripservices = dict trip_id -> service_id, stores the service of every node so searches can be limited to
+        #the services running on a date (see serviceMask)
+        tripservice = array('i', [self.services.intern(tripservices[self.trips.names[t]]) for t in xrange(len(self.trips))])
+        self.nodeservice = array('i', [tripservice[t] if t >= 0 else -1 for t in self.nodetrip])
+
+    def serviceMask(self, service_ids):
+        #service_ids = service_ids running on the query date, returns the active argument for dijkstra
+        #mask[service index] = 1 if the service runs, the extra last entry keeps virtual nodes (service -1) open
+        mask = bytearray(len(self.services)+1)
+        for service_id in service_ids:
+            ix = self.services.get(service_id)
+            if ix is not None:
+                mask[ix] = 1
+        mask[-1] = 1
+        return mask
+
+    def numberOfNodes(self):
+        return len(self.nodetrip)
+
+    def numberOfEdges(self):
+        return len(self.targets)
+
+    def nodeId(self, name):
+        #'trip_id^stop_id' -> node
+        trip_id, stop_id = name.split('^')
+        try:
+            return self.event(trip_id, stop_id)
+        except KeyError:
+            raise KeyError('Node %s not in graph' % name)
+
+    def nodeName(self, node):
+        #node -> 'trip_id^stop_id' ('~node^stop_id' for virtual nodes)
+        if self.nodetrip[node] < 0:
+            return '~%d^%s' % (node, self.stops.names[self.nodestop[node]])
+        return self.trips.names[self.nodetrip[node]]+'^'+self.stops.names[self.nodestop[node]]
+
+    def edges(self):
+        #iterates (u, v, weight) over all edges (patched rows included)
+        offsets, targets, weights, patched = self.offsets, self.targets, self.weights, self.patched
+        for u in xrange(len(offsets)-1):
+            if u in patched:
+                for v, w in zip(*patched[u]):
+                    yield u, v, w
+                continue
+            for p in xrange(offsets[u], offsets[u+1]):
+                yield u, targets[p], weights[p]
+
+    def patchIndex(self):
+        '''indexes built on the first trip update: events of every trip in trip order (node order is stop_times.txt
+           order), the waiting chains of every stop as lists of (wait node, event it boards) in chain order (wait nodes
+           of a chain are consecutive) and the stops with footpaths into every stop
+           returns (trip index -> events, stop index -> chains, stop index -> from stop indices)
+        '''
+        if self._patchindex is None:
+            offsets, targets = self.offsets, self.targets
+            nodetrip, nodestop = self.nodetrip, self.nodestop
+            tripevents = {}
+            chains = {}
+            for u in xrange(len(nodetrip)):
+                if nodetrip[u] >= 0:
+                    tripevents.setdefault(nodetrip[u], []).append(u)
+                    continue
+                row = [targets[p] for p in xrange(offsets[u], offsets[u+1])]
+                event = [v for v in row if nodetrip[v] >= 0]
+                stopchains = chains.setdefault(nodestop[u], [])
+                #--> u continues the chain of u-1 if u-1 waits for u
+                if not stopchains or stopchains[-1][-1][0] <> u-1 or u not in waitsfor:
+                    stopchains.append([])
+                stopchains[-1].append((u, event[0] if event else -1))
+                waitsfor = row
+            footin = {}
+            for six in xrange(len(self.footoffsets)-1):
+                for p in xrange(self.footoffsets[six], self.footoffsets[six+1]):
+                    footin.setdefault(self.footstops[p], []).append(six)
+            self._patchindex = (tripevents, chains, footin)
+        return self._patchindex
+
+    def patchRows(self, nodes):
+        '''nodes = nodes whose out edges are replaced by the edges collected with addEdge() since finalize(), nodes
+           without collected edges lose all their out edges, parallel edges collapse to the cheapest as in finalize()
+           The CSR arrays are not touched (so this works on a mapped snapshot as well), rows with the same edges as their
+           CSR row (in any order) are dropped from the overlay. The graph version is bumped.
+        '''
+        rows = dict((u, ([], [])) for u in nodes)
+        for u, v, w in zip(self._src, self._dst, self._wt):
+            rows[u][0].append(v)
+            rows[u][1].append(w)
+        self._src, self._dst, self._wt = array('i'), array('i'), array('i')
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        for u, (tgts, wts) in rows.iteritems():
+            if len(set(tgts)) < len(tgts):
+                best = {}
+                for v, w in zip(tgts, wts):
+                    if v not in best or w < best[v]:
+                        best[v] = w
+                tgts, wts = [], []
+                for v in rows[u][0]:
+                    if v in best:
+                        tgts.append(v)
+                        wts.append(best.pop(v))
+            beg, end = offsets[u], offsets[u+1]
+            if len(tgts) == end - beg and sorted(zip(tgts, wts)) == sorted(zip(targets[beg:end], weights[beg:end])):
+                self.patched.pop(u, None)
+            else:
+                self.patched[u] = (array('i', tgts), array('i', wts))
+        self.version += 1
+
+    def dijkstra(self, sources, target=None, cutoff=None, active=None, targets=None, xferpen=0, until=None):
+        '''sources = dict of node -> initial cost (or a single node starting at 0)
+           target = node, or set of nodes, at which the search stops once the first one is settled
+                  or dict of node -> extra cost (virtual sink, e.g. egress walk), the search stops once no node can
+                  give a lower cost + extra cost than the best target settled, that target is returned (a sink only
+                  counts when reached on its own trip, i.e. as an arrival, not as a source or boarded over a transfer)
+           targets = set of nodes, the search stops once all of them are settled (one to many searches)
+           cutoff = nodes further than this are not settled
+           active = serviceMask() of the query date, nodes of trips not running that day are skipped (None--> all nodes)
+           xferpen = transfer penalty the graph was built with, taken off every transfer edge (from an event to a node
+                     of another trip) so costs are travel times, e.g. for time budgets (0--> costs as built)
+           until = clock time bound in secs (needs xferpen): events arriving after it and wait nodes waiting for a
+                   departure after it are not settled. Use it for time budgets instead of a cutoff, costs can be above
+                   the time taken (a transfer costs at least 60 secs) so a cutoff drops events reached in time.
+           returns dist (node -> cost), pred (node -> previous node) for settled nodes and the target reached (or None)
+        '''
+        if not isinstance(sources, dict):
+            sources = {sources: 0}
+        remaining = set(targets) if targets else None
+        sinks = None
+        if target is None:
+            stopat = ()
+        elif isinstance(target, dict):
+            stopat = ()
+            sinks = target
+        elif isinstance(target, (set, frozenset)):
+            stopat = target
+        else:
+            stopat = (target,)
+        best = bestnode = None
+        offsets, csrtargets, csrweights, patched = self.offsets, self.targets, self.weights, self.patched
+        nodeservice, nodetrip = self.nodeservice, self.nodetrip
+        if active is not None and len(nodeservice):
+            sources = dict((u, c) for u, c in sources.iteritems() if active[nodeservice[u]])
+        else:
+            active = None
+        ut = -1
+        nodearr = self.nodearr
+        clock = {}  #--> wait node -> departure it waits for (until only)
+        dist = {}
+        seen = dict(sources)
+        pred = {}
+        heap = [(c, u) for u, c in sources.iteritems()]
+        heap.sort()
+        while heap:
+            c, u = heappop(heap)
+            if u in dist:
+                continue
+            if cutoff is not None and c > cutoff:
+                break
+            if best is not None and c >= best:
+                break   #--> every later target costs at least c (extra costs are >= 0)
+            dist[u] = c
+            if u in stopat:
+                return dist, pred, u
+            if sinks is not None and u in sinks and u in pred and nodetrip[pred[u]] == nodetrip[u] and \
+               (best is None or c + sinks[u] < best):
+                best, bestnode = c + sinks[u], u
+            if remaining is not None and u in remaining:
+                remaining.discard(u)
+                if not remaining:
+                    return dist, pred, u
+            if xferpen:
+                ut = nodetrip[u]
+            if patched and u in patched:
+                tgts, wts = patched[u]
+                edges = xrange(len(tgts))
+            else:
+                tgts, wts = csrtargets, csrweights
+                edges = xrange(offsets[u], offsets[u+1])
+            for p in edges:
+                v = tgts[p]
+                if active is not None and not active[nodeservice[v]]:
+                    continue
+                vc = c + wts[p]
+                if xferpen and ut >= 0 and nodetrip[v] <> ut:
+                    vc -= xferpen
+                if until is not None:
+                    if nodetrip[v] >= 0:
+                        if nodearr[v] > until:
+                            continue
+                    else:
+                        #--> edges into wait nodes cost the wait exactly (no 60 secs minimum)
+                        vt = (nodearr[u] if nodetrip[u] >= 0 else clock[u]) + vc - c
+                        if vt > until:
+                            continue
+                        clock[v] = vt
+                if v not in dist and (v not in seen or vc < seen[v]):
+                    seen[v] = vc
+                    pred[v] = u
+                    heappush(heap, (vc, v))
+        return dist, pred, bestnode
+
+    def path(self, pred, node):
+        #walks the predecessor map back from node
+        path = [node]
+        while node in pred:
+            node = pred[node]
+            path.append(node)
+        path.reverse()
+        return path
+
+    def shortestPath(self, o, d, active=None):
+        #returns (cost, list of nodes) from o to d, o/d as nodes or 'trip_id^stop_id' names
+        #active = serviceMask() of the query date (graphs covering the whole feed period)
+        if not isinstance(o, (int, long)):
+            o = self.nodeId(o)
+        if not isinstance(d, (int, long)):
+            d = self.nodeId(d)
+        dist, pred, reached = self.dijkstra(o, d, active=active)
+        if reached is None:
+            raise NoPath('No path between %s and %s' % (self.nodeName(o), self.nodeName(d)))
+        return dist[d], self.path(pred, d)
+
+    def dijkstraPath(self, o, d, active=None):
+        #same as nx.dijkstra_path, returns list of 'trip_id^stop_id' names (virtual nodes are left out)
+        return [self.nodeName(node) for node in self.shortestPath(o, d, active)[1] if self.nodetrip[node] >= 0]
+
+    def toNetworkX(self, weight='time'):
+        #exports the graph as networkx DiGraph with 'trip_id^stop_id' node names
+        import networkx as nx
+        G = nx.DiGraph()
+        G.add_weighted_edges_from(((self.nodeName(u), self.nodeName(v), w) for u, v, w in self.edges()), weight)
+        return G
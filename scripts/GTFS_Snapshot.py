@@ -0,0 +1,259 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS graph snapshot
+# Purpose:     Saves a built search graph and its lookups to disk so the route server can start without re-parsing
+#              the feed. Graph and ID table arrays are written as raw binary files and mapped back read-only with
+#              mmap (pages are only read when touched and are shared by every process mapping the same snapshot),
+#              the lookup dicts are pickled (stoptrips and getstopid are views over the graph columns). A snapshot is only used if its key (hash of the feed files and the
+#              build parameters) matches.
+#
+# Dependencies: standard python modules only
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import os, shutil, time
+import hashlib
+import mmap
+import ctypes
+import cPickle as pickle
+from array import array
+from GTFS_SearchGraph import SearchGraph, StopTrips, EventTimes
+from GTFS_FeedReader import GTFSFeed
+
+SNAPSHOTVERSION = 4
+FEEDFILES = ['stops.txt', 'trips.txt', 'stop_times.txt', 'calendar.txt', 'calendar_dates.txt', 'transfers.txt']
+CTYPES = {'i': ctypes.c_int, 'l': ctypes.c_long, 'd': ctypes.c_double, 'c': ctypes.c_char}
+
+
+def feedKey(dir, xferpen, calmethod, date='', day='', **options):
+    '''dir = directory path of the GTFS file set or GTFS zip archive
+       xferpen, calmethod, date, day and options (e.g. prune) = build parameters as passed to BuildSearchGraph
+       returns a hex digest of the feed files used to build the graph and the build parameters
+    '''
+    h = hashlib.sha1()
+    feed = GTFSFeed(dir)
+    for name in FEEDFILES:
+        if not feed.has(name):
+            continue
+        h.update(name)
+        fn = feed.open(name)
+        while True:
+            chunk = fn.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+        fn.close()
+    feed.close()
+    h.update(repr((SNAPSHOTVERSION, xferpen, calmethod, date, day, sorted(options.items()))))
+    return h.hexdigest()
+
+
+def _mapArray(path, typecode, length):
+    #maps a snapshot file read-only as ctypes array (indexing returns python ints/floats, slices of 'c' arrays are str)
+    if not length:
+        return (CTYPES[typecode]*0)()
+    fn = open(path, 'rb')
+    mm = mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_COPY)  #--> copy on write: pages stay shared unless written
+    fn.close()
+    return (CTYPES[typecode]*length).from_buffer(mm)         #--> the array keeps a reference to the mapping
+
+
+class MappedNames(object):
+    '''sequence of names stored as one blob (_names.bin) plus offsets (_offsets.bin)'''
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]]
+
+
+class MappedIDTable(object):
+    '''read-only IDTable over mapped arrays, name -> index is a binary search over the names in sorted order'''
+    def __init__(self, names, order):
+        self.names = names
+        self.order = order
+
+    def __len__(self):
+        return len(self.names)
+
+    def _find(self, name):
+        names, order = self.names, self.order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if names[order[mid]] < name:
+                lo = mid+1
+            else:
+                hi = mid
+        if lo < len(order) and names[order[lo]] == name:
+            return order[lo]
+        return -1
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def __getitem__(self, name):
+        ix = self._find(name)
+        if ix < 0:
+            raise KeyError(name)
+        return ix
+
+    def get(self, name, default=None):
+        ix = self._find(name)
+        return default if ix < 0 else ix
+
+
+class MappedEventIndex(object):
+    '''read-only replacement of SearchGraph.nodeindex, (trip index << 32 | stop index) -> node
+       by binary search over the event nodes sorted by (trip index, stop index)
+    '''
+    def __init__(self, nodetrip, nodestop, order):
+        self.nodetrip = nodetrip
+        self.nodestop = nodestop
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def get(self, key, default=None):
+        tix, six = key >> 32, key & 0xFFFFFFFF
+        nodetrip, nodestop, order = self.nodetrip, self.nodestop, self.order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo+hi)//2
+            node = order[mid]
+            if (nodetrip[node], nodestop[node]) < (tix, six):
+                lo = mid+1
+            else:
+                hi = mid
+        if lo < len(order):
+            node = order[lo]
+            if nodetrip[node] == tix and nodestop[node] == six:
+                return node
+        return default
+
+    def __getitem__(self, key):
+        node = self.get(key)
+        if node is None:
+            raise KeyError(key)
+        return node
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+def _writeArray(dir, name, data, typecode, meta):
+    fn = open(os.path.join(dir, name+'.bin'), 'wb')
+    if not isinstance(data, array):
+        data = array(typecode, data)
+    data.tofile(fn)
+    fn.close()
+    meta['arrays'][name] = (typecode, len(data))
+
+def _writeIDTable(dir, name, table, meta):
+    names = [table.names[i] for i in xrange(len(table))]
+    offsets = array('l', [0])
+    for n in names:
+        offsets.append(offsets[-1]+len(n))
+    fn = open(os.path.join(dir, name+'_names.bin'), 'wb')
+    for n in names:
+        fn.write(n)
+    fn.close()
+    meta['arrays'][name+'_names'] = ('c', offsets[-1])
+    _writeArray(dir, name+'_offsets', offsets, 'l', meta)
+    _writeArray(dir, name+'_order', sorted(xrange(len(names)), key=names.__getitem__), 'i', meta)
+
+
+def saveSnapshot(path, key, G, validservices, validtrips, stoptrips, getstopid, stopdata, engines=()):
+    '''path = snapshot directory (replaced if it exists)
+       key = feedKey() of the feed and build parameters
+       G, validservices, validtrips, stoptrips, getstopid, stopdata = as returned by BuildSearchGraph (stoptrips and
+       getstopid are views over the columns of G and are not stored)
+       engines = query engines filled by BuildSearchGraph (ConnectionScan, Raptor), pickled
+    '''
+    ts = time.time()
+    tmp = path+'.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    meta = {'version': SNAPSHOTVERSION, 'key': key, 'arrays': {}, 'pruned': G.pruned}
+    for name in ['offsets', 'targets', 'weights', 'nodetrip', 'nodestop', 'nodearr', 'nodedep', 'stopoffsets',
+                 'stopevents', 'stoparrs', 'stopdeps', 'footoffsets', 'footstops', 'footwalks']:
+        data = getattr(G, name)
+        _writeArray(tmp, name, data, data.typecode, meta)
+    events = [node for node in xrange(G.numberOfNodes()) if G.nodetrip[node] >= 0]
+    events.sort(key=lambda node: (G.nodetrip[node], G.nodestop[node]))
+    _writeArray(tmp, 'eventorder', events, 'i', meta)
+    del events
+    _writeIDTable(tmp, 'trips', G.trips, meta)
+    _writeIDTable(tmp, 'stops', G.stops, meta)
+    if len(G.nodeservice):
+        _writeArray(tmp, 'nodeservice', G.nodeservice, 'i', meta)
+        _writeIDTable(tmp, 'services', G.services, meta)
+    fn = open(os.path.join(tmp, 'lookups.pkl'), 'wb')
+    pickle.dump((validservices, validtrips, stopdata), fn, pickle.HIGHEST_PROTOCOL)
+    fn.close()
+    if engines:
+        fn = open(os.path.join(tmp, 'engines.pkl'), 'wb')
+        pickle.dump(list(engines), fn, pickle.HIGHEST_PROTOCOL)
+        fn.close()
+    fn = open(os.path.join(tmp, 'meta.pkl'), 'wb')   #--> written last, a snapshot without meta is never loaded
+    pickle.dump(meta, fn, pickle.HIGHEST_PROTOCOL)
+    fn.close()
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    print 'Saved graph snapshot to ', path, ' in ', time.time()-ts, ' secs'
+
+
+def loadSnapshot(path, key, engines=()):
+    '''path = snapshot directory written by saveSnapshot()
+       key = feedKey() the snapshot must have been built with
+       engines = query engines to load the stored engines into (same classes in the same order as saved)
+       returns G, validservices, validtrips, stoptrips, getstopid, stopdata as BuildSearchGraph (G is read-only and
+       mapped from the snapshot files) or None if there is no valid snapshot
+    '''
+    metafile = os.path.join(path, 'meta.pkl')
+    if not os.path.exists(metafile):
+        return None
+    fn = open(metafile, 'rb')
+    meta = pickle.load(fn)
+    fn.close()
+    if meta.get('version') <> SNAPSHOTVERSION or meta.get('key') <> key:
+        print 'Graph snapshot in ', path, ' is out of date, ignoring it'
+        return None
+    if engines:
+        if not os.path.exists(os.path.join(path, 'engines.pkl')):
+            return None
+        fn = open(os.path.join(path, 'engines.pkl'), 'rb')
+        for engine, stored in zip(engines, pickle.load(fn)):
+            engine.__dict__.update(stored.__dict__)
+        fn.close()
+    ts = time.time()
+    arrays = {}
+    for name, (typecode, length) in meta['arrays'].iteritems():
+        arrays[name] = _mapArray(os.path.join(path, name+'.bin'), typecode, length)
+    G = SearchGraph()
+    G.offsets, G.targets, G.weights = arrays['offsets'], arrays['targets'], arrays['weights']
+    G.nodetrip, G.nodestop = arrays['nodetrip'], arrays['nodestop']
+    G.nodearr, G.nodedep = arrays['nodearr'], arrays['nodedep']
+    G.stopoffsets, G.stopevents = arrays['stopoffsets'], arrays['stopevents']
+    G.stoparrs, G.stopdeps = arrays['stoparrs'], arrays['stopdeps']
+    G.footoffsets, G.footstops, G.footwalks = arrays['footoffsets'], arrays['footstops'], arrays['footwalks']
+    G.trips = MappedIDTable(MappedNames(arrays['trips_names'], arrays['trips_offsets']), arrays['trips_order'])
+    G.stops = MappedIDTable(MappedNames(arrays['stops_names'], arrays['stops_offsets']), arrays['stops_order'])
+    G.nodeindex = MappedEventIndex(G.nodetrip, G.nodestop, arrays['eventorder'])
+    G.pruned = meta['pruned']
+    if arrays.has_key('nodeservice'):
+        G.nodeservice = arrays['nodeservice']
+        G.services = MappedIDTable(MappedNames(arrays['services_names'], arrays['services_offsets']), arrays['services_order'])
+    fn = open(os.path.join(path, 'lookups.pkl'), 'rb')
+    validservices, validtrips, stopdata = pickle.load(fn)
+    fn.close()
+    stoptrips, getstopid = StopTrips(G), EventTimes(G)
+    print 'Loaded graph snapshot from ', path, ' in ', time.time()-ts, ' secs'
+    return G, validservices, validtrips, stoptrips, getstopid, stopdata
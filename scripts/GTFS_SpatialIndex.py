@@ -0,0 +1,156 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS spatial index
+# Purpose:     Lat/lon grid over stops.txt used to look up stops near a point (access/egress candidates, transfers)
+#              without scanning every stop. Distances use the same great circle formula as computeGCD, vectorized
+#              with numpy when it is installed.
+#
+# Dependencies: standard python modules, numpy is optional (batched distance computation)
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+from math import *
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTHRADIUS = 3963.19059  #miles
+MILESPERDEGLAT = EARTHRADIUS*pi/180
+
+
+def computeGCD(lat1,lon1,lat2,lon2):
+    #computes great circle distance from lat/lon
+    '''lat1/lon1 = lat/lon of first pt
+       lat2/lon2 = lat/lon of second pt
+    '''
+    degRad = pi/180
+    lat1 = degRad*lat1
+    lon1 = degRad*lon1
+    lat2 = degRad*lat2
+    lon2 = degRad*lon2
+    dellambda = lon2-lon1
+    Numerator = sqrt((cos(lat2)*sin(dellambda))**2 + (cos(lat1)*sin(lat2)- sin(lat1)*cos(lat2)*cos(dellambda))**2)
+    Denominator = sin(lat1)*sin(lat2) + cos(lat1)*cos(lat2)*cos(dellambda)
+    delSigma = atan2(Numerator,Denominator)
+
+    return EARTHRADIUS*delSigma
+
+
+def computeGCDArray(lat1, lon1, lats, lons):
+    #computeGCD from pt(s) to numpy arrays of lat/lon, lat1/lon1 may be scalars or arrays of the same length
+    degRad = pi/180
+    lat1 = degRad*np.asarray(lat1, dtype=np.float64)
+    lon1 = degRad*np.asarray(lon1, dtype=np.float64)
+    lat2 = degRad*lats
+    dellambda = degRad*lons - lon1
+    coslat1 = np.cos(lat1)
+    sinlat1 = np.sin(lat1)
+    coslat2 = np.cos(lat2)
+    sinlat2 = np.sin(lat2)
+    cosdel = np.cos(dellambda)
+    Numerator = np.sqrt((coslat2*np.sin(dellambda))**2 + (coslat1*sinlat2 - sinlat1*coslat2*cosdel)**2)
+    Denominator = sinlat1*sinlat2 + coslat1*coslat2*cosdel
+    return EARTHRADIUS*np.arctan2(Numerator, Denominator)
+
+
+class StopIndex(object):
+    '''grid of cellsize x cellsize degree cells over the stops
+       stopdata = stopdata dictionary with -> key:stop_id, values[stop_name, stop_lat, stop_lon]
+       Stops are stored sorted by cell so every cell is a contiguous slice of stopids/lats/lons.
+    '''
+    def __init__(self, stopdata, cellsize=0.01):
+        self.cellsize = cellsize
+        cellof = {}
+        for stopid in stopdata:
+            cellof[stopid] = (int(floor(stopdata[stopid][1]/cellsize)), int(floor(stopdata[stopid][2]/cellsize)))
+        self.stopids = sorted(stopdata.keys(), key=lambda stopid: cellof[stopid])
+        self.cells = {}
+        for i, stopid in enumerate(self.stopids):
+            cell = cellof[stopid]
+            if cell in self.cells:
+                self.cells[cell][1] = i+1
+            else:
+                self.cells[cell] = [i, i+1]
+        if np is not None:
+            self.lats = np.array([stopdata[stopid][1] for stopid in self.stopids], dtype=np.float64)
+            self.lons = np.array([stopdata[stopid][2] for stopid in self.stopids], dtype=np.float64)
+        else:
+            self.lats = array('d', [stopdata[stopid][1] for stopid in self.stopids])
+            self.lons = array('d', [stopdata[stopid][2] for stopid in self.stopids])
+
+    def __len__(self):
+        return len(self.stopids)
+
+    def _slices(self, lat, lon, maxDist):
+        #index ranges of the cells that may hold stops within maxDist of lat/lon
+        cs = self.cellsize
+        dlat = maxDist/MILESPERDEGLAT
+        dlon = maxDist/(MILESPERDEGLAT*max(cos(radians(min(abs(lat)+dlat, 90.0))), 0.01))
+        lat0, lat1 = int(floor((lat-dlat)/cs)), int(floor((lat+dlat)/cs))
+        lon0, lon1 = int(floor((lon-dlon)/cs)), int(floor((lon+dlon)/cs))
+        if (lat1-lat0+1)*(lon1-lon0+1) > len(self.cells):
+            return [rng for cell, rng in self.cells.iteritems()
+                    if lat0 <= cell[0] <= lat1 and lon0 <= cell[1] <= lon1]
+        slices = []
+        for ilat in xrange(lat0, lat1+1):
+            for ilon in xrange(lon0, lon1+1):
+                rng = self.cells.get((ilat, ilon))
+                if rng is not None:
+                    slices.append(rng)
+        return slices
+
+    def near(self, point, maxDist, inclusive=False):
+        #returns list of (index, distance in miles) of stops closer than maxDist to point (lat/lon)
+        #inclusive = also return stops exactly maxDist away
+        lat, lon = point[0], point[1]
+        slices = self._slices(lat, lon, maxDist)
+        if not slices:
+            return []
+        if np is not None:
+            ix = np.concatenate([np.arange(beg, end) for beg, end in slices])
+            dist = computeGCDArray(lat, lon, self.lats[ix], self.lons[ix])
+            keep = dist <= maxDist if inclusive else dist < maxDist
+            return zip(ix[keep].tolist(), dist[keep].tolist())
+        found = []
+        for beg, end in slices:
+            for i in xrange(beg, end):
+                dist = computeGCD(lat, lon, self.lats[i], self.lons[i])
+                if dist < maxDist or (inclusive and dist == maxDist):
+                    found.append((i, dist))
+        return found
+
+    def candidates(self, point, maxDist):
+        #returns a dict with list stopID -> walk time, stop(lat/lon) as getCandidateStops
+        found = {}
+        for i, dist in self.near(point, maxDist):
+            found[self.stopids[i]] = [dist*3600/3.0, (float(self.lats[i]), float(self.lons[i]))]
+        return found
+
+    def candidateStops(self, oPoint, dPoint, maxDist):
+        return self.candidates(oPoint, maxDist), self.candidates(dPoint, maxDist)
+
+    def batchCandidates(self, points, maxDist):
+        #candidates() for a list of lat/lon points, returns list of dicts in the same order
+        #with numpy all (point, stop) pairs of the batch go through a single computeGCDArray call
+        if np is None:
+            return [self.candidates(point, maxDist) for point in points]
+        pix = []
+        six = []
+        for k, point in enumerate(points):
+            for beg, end in self._slices(point[0], point[1], maxDist):
+                pix.append(np.repeat(k, end-beg))
+                six.append(np.arange(beg, end))
+        found = [{} for point in points]
+        if not pix:
+            return found
+        pix = np.concatenate(pix)
+        six = np.concatenate(six)
+        plats = np.array([point[0] for point in points], dtype=np.float64)[pix]
+        plons = np.array([point[1] for point in points], dtype=np.float64)[pix]
+        dist = computeGCDArray(plats, plons, self.lats[six], self.lons[six])
+        keep = dist < maxDist
+        for k, i, dist in zip(pix[keep].tolist(), six[keep].tolist(), dist[keep].tolist()):
+            found[k][self.stopids[i]] = [dist*3600/3.0, (float(self.lats[i]), float(self.lons[i]))]
+        return found
@@ -0,0 +1,101 @@
+#-----------------------------------------------------------------------------------------------------------------------
+# Name:        GTFS stats (instrumentation for the route server and the benchmarks)
+# Purpose:     Wall time, peak memory and counts (edges etc.) of the phases of a graph build, and latency
+#              percentiles of queries per method. The server reports both with its Stats call, GTFS_Benchmark.py
+#              prints them.
+#
+# Dependencies: standard python modules, resource (peak memory) is not available on Windows
+#
+# Licence:     The MIT License (MIT), see LICENSE
+#----------------------------------------------------------------------------------------------------------------------
+
+import sys
+import time
+import threading
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peakMemory():
+    #peak resident memory in MB of this process and of its largest finished child (e.g. forked build workers),
+    #None where the resource module is missing
+    if resource is None:
+        return None, None
+    scale = 1024.0*1024 if sys.platform == 'darwin' else 1024.0    #--> ru_maxrss is in bytes on macOS, KB elsewhere
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/scale)
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    #samples = list of numbers, returns dict 'p50' etc. -> value (nearest rank) plus 'max', empty dict if no samples
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    result = {}
+    for p in points:
+        result['p%d' % p] = samples[min(len(samples)-1, int(len(samples)*p/100.0))]
+    result['max'] = samples[-1]
+    return result
+
+
+class PhaseTimer(object):
+    '''phases of a build in order, each from the end of the previous one (or from the timer start)
+       mark() ends the running phase, phases() returns them as list of dicts (name, secs, peak MB and counts)
+    '''
+    def __init__(self):
+        self.start = self.last = time.time()
+        self.rows = []
+
+    def mark(self, name, **counts):
+        #ends the phase name with the counts given (e.g. edges=...), returns its secs
+        now = time.time()
+        secs = now - self.last
+        self.last = now
+        row = {'phase': name, 'secs': secs, 'peak_mb': peakMemory()[0]}
+        row.update(counts)
+        self.rows.append(row)
+        return secs
+
+    def total(self):
+        return time.time() - self.start
+
+    def phases(self):
+        return [dict(row) for row in self.rows]
+
+
+class QueryStats(object):
+    '''latency of calls per method, the last maxsamples calls of every method are kept for the percentiles
+       Safe to share between threads, forked workers each record their own calls.
+    '''
+    def __init__(self, maxsamples=10000):
+        self.maxsamples = maxsamples
+        self.methods = {}   #method -> [calls, errors, total secs, ring buffer of secs, next ring position]
+        self.lock = threading.Lock()
+
+    def record(self, method, secs, error=False):
+        with self.lock:
+            entry = self.methods.get(method)
+            if entry is None:
+                entry = self.methods[method] = [0, 0, 0.0, [], 0]
+            entry[0] += 1
+            entry[1] += int(error)
+            entry[2] += secs
+            if len(entry[3]) < self.maxsamples:
+                entry[3].append(secs)
+            else:
+                entry[3][entry[4]] = secs
+                entry[4] = (entry[4] + 1) % self.maxsamples
+
+    def report(self):
+        #method -> dict of calls, errors, mean and percentile latencies in ms
+        with self.lock:
+            entries = [(method, entry[0], entry[1], entry[2], list(entry[3])) for method, entry in self.methods.iteritems()]
+        result = {}
+        for method, calls, errors, total, samples in entries:
+            row = {'calls': calls, 'errors': errors, 'mean_ms': total*1000.0/calls}
+            for key, secs in percentiles(samples).iteritems():
+                row[key + '_ms'] = secs*1000.0
+            result[method] = row
+        return result